@@ -0,0 +1,71 @@
+# Bookmark tracking of the record loop in process_records: the previous implementation
+# (three strptime_to_utc and a strftime per record) vs. parsing each value once and
+# keeping the maximum as datetime.
+#
+# Usage: python benchmarks/bench_bookmark.py [--records 1000000]
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from singer.utils import strptime_to_utc, strftime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tap_awin_advertiser.transform import parse_datetime  # pylint: disable=wrong-import-position
+
+BOOKMARK_FIELD = 'transaction_date'
+
+
+def previous_loop(records, last_datetime):
+    max_bookmark_value = last_datetime
+    for record in records:
+        if BOOKMARK_FIELD in record:
+            bookmark_date = record.get(BOOKMARK_FIELD)
+            bookmark_dttm = strptime_to_utc(bookmark_date)
+            last_dttm = strptime_to_utc(last_datetime)  # pylint: disable=unused-variable
+            if not max_bookmark_value:
+                max_bookmark_value = last_datetime
+            max_bookmark_dttm = strptime_to_utc(max_bookmark_value)
+            if bookmark_dttm > max_bookmark_dttm:
+                max_bookmark_value = strftime(bookmark_dttm)
+    return max_bookmark_value
+
+
+def current_loop(records, last_datetime):
+    max_bookmark_dttm = strptime_to_utc(last_datetime)
+    for record in records:
+        bookmark_date = record.get(BOOKMARK_FIELD)
+        if bookmark_date:
+            bookmark_dttm = parse_datetime(bookmark_date)
+            if bookmark_dttm > max_bookmark_dttm:
+                max_bookmark_dttm = bookmark_dttm
+    return strftime(max_bookmark_dttm)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=1000000)
+    args = parser.parse_args()
+
+    # Transformed records carry singer formatted date-times
+    base = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    records = [{'id': i, BOOKMARK_FIELD: strftime(base + timedelta(seconds=(i * 7919) % 10000000))}
+               for i in range(args.records)]
+    last_datetime = '2020-01-01T00:00:00Z'
+
+    results = {}
+    timings = {}
+    for name, loop in (('previous', previous_loop), ('current', current_loop)):
+        start = time.perf_counter()
+        results[name] = loop(records, last_datetime)
+        timings[name] = time.perf_counter() - start
+        print('{:<10} {:>8.2f} s {:>12.0f} records/s'.format(
+            name, timings[name], len(records) / timings[name]))
+    assert results['previous'] == results['current'], results
+    print('speedup: {:.1f}x'.format(timings['previous'] / timings['current']))
+
+
+if __name__ == '__main__':
+    main()
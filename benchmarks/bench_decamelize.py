@@ -0,0 +1,44 @@
+# Decamelize realistic transaction records: humps.decamelize vs. the memoized
+# tap_awin_advertiser.transform.decamelize (same output is checked first).
+#
+# Usage: python benchmarks/bench_decamelize.py [--records 100000]
+import argparse
+import copy
+import os
+import sys
+import time
+
+import humps
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_data import fake_transaction  # pylint: disable=wrong-import-position
+from tap_awin_advertiser.transform import decamelize  # pylint: disable=wrong-import-position
+
+
+def bench(name, func, records):
+    start = time.perf_counter()
+    for record in records:
+        func(record)
+    elapsed = time.perf_counter() - start
+    print('{:<10} {:>8.2f} s {:>12.0f} records/s'.format(name, elapsed, len(records) / elapsed))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=100000)
+    args = parser.parse_args()
+
+    records = [fake_transaction(1001, i) for i in range(args.records)]
+    for record in records[:1000]:
+        assert decamelize(copy.deepcopy(record)) == humps.decamelize(copy.deepcopy(record))
+
+    humps_time = bench('humps', humps.decamelize, records)
+    cached_time = bench('cached', decamelize, records)
+    print('speedup: {:.1f}x'.format(humps_time / cached_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# In-run deduplication of record ids: dedup.IdSet (sorted array of 64 bit integers and a
+# set of the recent ids) vs. a plain set, for ids in ascending order (transactions in date
+# order) and in random order. Reports the time per id and the memory of the structure
+# after --ids ids, of which --duplicates (share) were seen before. The memory includes the
+# integer objects kept by the sets (the ids of the records are freed otherwise).
+# tracemalloc is not used, it slows down the IdSet many times more than the set.
+#
+# Usage: python benchmarks/bench_dedup.py [--ids 5000000] [--duplicates 0.05]
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tap_awin_advertiser.dedup import IdSet  # pylint: disable=wrong-import-position
+
+# Size of an integer object (28 bytes) with the allocator alignment
+INT_BYTES = 32
+
+
+class PlainSet:
+    def __init__(self):
+        self.ids = set()
+        self.duplicates = 0
+
+    def add(self, record_id):
+        if record_id in self.ids:
+            self.duplicates += 1
+            return False
+        self.ids.add(record_id)
+        return True
+
+
+def memory_bytes(seen):
+    if isinstance(seen, IdSet):
+        return sys.getsizeof(seen.ids) + sys.getsizeof(seen.pending) + \
+            INT_BYTES * len(seen.pending)
+    return sys.getsizeof(seen.ids) + INT_BYTES * len(seen.ids)
+
+
+def make_ids(count, duplicates, ordered, seed=0):
+    rand = random.Random(seed)
+    unique = list(range(100000000, 100000000 + count * 3, 3))
+    if not ordered:
+        rand.shuffle(unique)
+    # Duplicates of recent ids, like records returned again by an overlapping window
+    ids = []
+    for record_id in unique:
+        if len(ids) >= count:
+            break
+        if ids and rand.random() < duplicates:
+            ids.append(ids[max(0, len(ids) - rand.randrange(1, 1000))])
+        ids.append(record_id)
+    return ids[:count]
+
+
+def run(structure, ids):
+    start = time.perf_counter()
+    seen = structure()
+    for record_id in ids:
+        seen.add(record_id)
+    seconds = time.perf_counter() - start
+    return seconds, memory_bytes(seen), seen.duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ids', type=int, default=5000000)
+    parser.add_argument('--duplicates', type=float, default=0.05,
+                        help='share of the ids that were seen before')
+    args = parser.parse_args()
+
+    print('{:<10} {:<8} {:>10} {:>10} {:>12} {:>11}'.format(
+        'order', 'struct', 'seconds', 'ns/id', 'memory MB', 'duplicates'))
+    for order in ('ascending', 'random'):
+        ids = make_ids(args.ids, args.duplicates, order == 'ascending')
+        for name, structure in (('IdSet', IdSet), ('set', PlainSet)):
+            seconds, memory, duplicates = run(structure, ids)
+            print('{:<10} {:<8} {:>10.2f} {:>10.0f} {:>12.1f} {:>11}'.format(
+                order, name, seconds, seconds * 1e9 / len(ids),
+                memory / 1048576.0, duplicates))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+# End-to-end benchmark: runs the tap (tap_awin_advertiser.main, in a subprocess) against the
+# local fake Awin API (fake_awin_server.py) and reports wall time, records/s, requests/s and
+# the peak RSS of the tap. The output of the tap is counted and discarded. With config
+# output_format parquet or arrow, the records are counted in the files (requires pyarrow).
+#
+# Extra tap config (JSON) is merged into the generated config, e.g.
+#   --config '{"max_workers": 3, "stream_json": true}'
+# A state file can be passed to benchmark incremental syncs.
+#
+# Usage: python benchmarks/bench_e2e.py [--accounts 3] [--transactions 10000] [--days 365]
+#            [--publishers 50] [--latency-ms 0] [--rate-429 0.0] [--rate-503 0.0] [--gzip]
+#            [--config '{...}']
+#            [--state state.json] [--streams accounts,publishers,transactions] [--json]
+#            [--log tap.log]
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from urllib.request import urlopen
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_DIR)
+
+# pylint: disable=wrong-import-position
+from tap_awin_advertiser.discover import discover
+
+TAP_COMMAND = 'import tap_awin_advertiser; tap_awin_advertiser.main()'
+
+
+def start_server(args):
+    command = [
+        sys.executable, os.path.join(BENCHMARKS_DIR, 'fake_awin_server.py'),
+        '--port', '0',
+        '--accounts', str(args.accounts),
+        '--transactions', str(args.transactions),
+        '--days', str(args.days),
+        '--publishers', str(args.publishers),
+        '--latency-ms', str(args.latency_ms),
+        '--rate-429', str(args.rate_429),
+        '--rate-503', str(args.rate_503)]
+    if args.gzip:
+        command.append('--gzip')
+    server = subprocess.Popen(command, stdout=subprocess.PIPE)
+    port = int(server.stdout.readline())
+    return server, 'http://127.0.0.1:{}'.format(port)
+
+
+def server_stats(base_url):
+    with urlopen('{}/_stats'.format(base_url)) as response:
+        return json.loads(response.read())
+
+
+def write_catalog(path, streams=None):
+    catalog = discover().to_dict()
+    for stream in catalog['streams']:
+        selected = streams is None or stream['tap_stream_id'] in streams
+        for mdata in stream['metadata']:
+            if not mdata['breadcrumb']:
+                mdata['metadata']['selected'] = selected
+    with open(path, 'w') as file:
+        json.dump(catalog, file)
+
+
+# Run the tap, count its messages and return (exit status, rusage, message counts)
+def run_tap(config_path, catalog_path, state_path, log_file):
+    command = [sys.executable, '-c', TAP_COMMAND,
+               '--config', config_path, '--catalog', catalog_path]
+    if state_path:
+        command += ['--state', state_path]
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [REPO_DIR, env.get('PYTHONPATH')]))
+
+    tap = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=log_file, env=env)
+    counts = {'_bytes': 0}
+    for line in tap.stdout:
+        counts['_bytes'] += len(line)
+        # Messages start with {"type": "<TYPE>" (simplejson) or {"type":"<TYPE>" (orjson)
+        message_type = line[8:24].lstrip(b' "').split(b'"', 1)[0].decode()
+        counts[message_type] = counts.get(message_type, 0) + 1
+    _, status, rusage = os.wait4(tap.pid, 0)
+    tap.returncode = os.waitstatus_to_exitcode(status) \
+        if hasattr(os, 'waitstatus_to_exitcode') else status >> 8
+    return tap.returncode, rusage, counts
+
+
+# Number of records and bytes of the record files (config output_format parquet or arrow)
+def count_file_records(output_dir, output_format):
+    import pyarrow.dataset # pylint: disable=import-outside-toplevel
+    records = 0
+    output_bytes = 0
+    for stream_name in os.listdir(output_dir):
+        dataset = pyarrow.dataset.dataset(
+            os.path.join(output_dir, stream_name), format=output_format, partitioning='hive')
+        records += dataset.count_rows()
+        output_bytes += sum(os.path.getsize(path) for path in dataset.files)
+    return records, output_bytes
+
+
+def add_arguments(parser):
+    parser.add_argument('--accounts', type=int, default=3)
+    parser.add_argument('--transactions', type=int, default=10000,
+                        help='transactions per account')
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--publishers', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--rate-503', type=float, default=0.0)
+    parser.add_argument('--gzip', action='store_true', help='gzip compressed responses')
+    parser.add_argument('--state', help='state file passed to the tap')
+    parser.add_argument('--streams', help='comma separated streams to select (default: all)')
+    parser.add_argument('--log', help='write the log (stderr) of the tap to this file')
+
+
+# Run the tap with the extra config (dict) against a new fake API server, return the results
+def run_benchmark(args, extra_config):
+    server, base_url = start_server(args)
+    work_dir = tempfile.mkdtemp(prefix='tap-awin-bench-')
+    try:
+        config = {
+            'oauth2_token': 'benchmark',
+            'base_url': base_url,
+            'start_date': (datetime.utcnow() - timedelta(days=args.days + 1)).strftime(
+                '%Y-%m-%dT00:00:00Z'),
+            # The fake API has no rate limit
+            'requests_per_minute': 1000000,
+            'rate_limit_burst': 1000
+        }
+        config.update(extra_config)
+        if config.get('output_format', 'singer') != 'singer':
+            config.setdefault('output_dir', os.path.join(work_dir, 'output'))
+        config_path = os.path.join(work_dir, 'config.json')
+        with open(config_path, 'w') as file:
+            json.dump(config, file)
+        catalog_path = os.path.join(work_dir, 'catalog.json')
+        write_catalog(catalog_path, args.streams.split(',') if args.streams else None)
+
+        log_path = args.log or os.path.join(work_dir, 'tap.log')
+        with open(log_path, 'wb') as log_file:
+            start = time.perf_counter()
+            returncode, rusage, counts = run_tap(config_path, catalog_path, args.state, log_file)
+            wall = time.perf_counter() - start
+        if returncode != 0:
+            with open(log_path, 'rb') as file:
+                sys.stderr.write(file.read().decode('utf-8', 'replace')[-4000:])
+            sys.exit('Tap failed with exit code {}'.format(returncode))
+
+        stats = server_stats(base_url)
+        if config.get('output_format', 'singer') != 'singer':
+            counts['RECORD'], output_bytes = count_file_records(
+                config['output_dir'], config['output_format'])
+        else:
+            output_bytes = counts.pop('_bytes', 0)
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    records = counts.get('RECORD', 0)
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss_mb = rusage.ru_maxrss / 1024.0
+    results = {
+        'wall_seconds': round(wall, 3),
+        'records': records,
+        'records_per_second': round(records / wall, 1),
+        'requests': stats['requests'],
+        'requests_per_second': round(stats['requests'] / wall, 1),
+        'throttled_requests': stats['throttled'],
+        'failed_requests': stats['failed'],
+        'response_mb': round(stats['bytes'] / 1048576.0, 1),
+        'state_messages': counts.get('STATE', 0),
+        'output_mb': round(output_bytes / 1048576.0, 1),
+        'peak_rss_mb': round(peak_rss_mb, 1),
+        'cpu_seconds': round(rusage.ru_utime + rusage.ru_stime, 3)
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    parser.add_argument('--config', default='{}', help='extra tap config (JSON)')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    results = run_benchmark(args, json.loads(args.config))
+    if args.json:
+        print(json.dumps(results))
+    else:
+        for key, value in results.items():
+            print('{:<22} {}'.format(key, value))
+
+
+if __name__ == '__main__':
+    main()
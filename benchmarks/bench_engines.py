@@ -0,0 +1,52 @@
+# Compare the threaded engine (requests) with the asyncio engine (aiohttp) end-to-end
+# against the local fake Awin API, with the same number of requests in flight:
+#   threads: max_workers accounts x window_workers windows (one thread per request)
+#   async:   async_concurrency = max_workers x window_workers, window_workers windows
+# Latency should be injected, otherwise there is nothing to overlap.
+#
+# Usage: python benchmarks/bench_engines.py [--accounts 20] [--transactions 2000]
+#            [--latency-ms 100] [--max-workers 5] [--window-workers 2]
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# pylint: disable=wrong-import-position
+from bench_e2e import add_arguments, run_benchmark
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    parser.add_argument('--max-workers', type=int, default=5)
+    parser.add_argument('--window-workers', type=int, default=2)
+    parser.set_defaults(accounts=20, transactions=2000, latency_ms=100.0)
+    args = parser.parse_args()
+
+    engines = [
+        ('threads', {
+            'max_workers': args.max_workers,
+            'window_workers': args.window_workers}),
+        ('async', {
+            'engine': 'async',
+            'async_concurrency': args.max_workers * args.window_workers,
+            'window_workers': args.window_workers}),
+    ]
+
+    print('{:<8} {:>8} {:>8} {:>10} {:>10} {:>8} {:>8}'.format(
+        'engine', 'wall s', 'records', 'records/s', 'requests/s', 'cpu s', 'RSS MB'))
+    for name, config in engines:
+        results = run_benchmark(args, config)
+        print('{:<8} {:>8.2f} {:>8} {:>10.0f} {:>10.1f} {:>8.2f} {:>8.1f}'.format(
+            name,
+            results['wall_seconds'],
+            results['records'],
+            results['records_per_second'],
+            results['requests_per_second'],
+            results['cpu_seconds'],
+            results['peak_rss_mb']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# Peak memory of decoding and transforming one large transactions window:
+# response.json() + list of decamelized records vs. the incremental decoder (stream_json).
+#
+# Usage: python benchmarks/bench_json_stream.py [--transactions 500000]
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_data import fake_transaction  # pylint: disable=wrong-import-position
+
+CHUNK_SIZE = 65536
+
+
+def write_window(path, transactions):
+    with open(path, 'w') as file:
+        file.write('[')
+        for i in range(transactions):
+            if i:
+                file.write(',')
+            json.dump(fake_transaction(1001, i), file)
+        file.write(']')
+
+
+def run_mode(mode, path):
+    from tap_awin_advertiser.json_stream import iter_json_array
+    from tap_awin_advertiser.sync import transform_records
+
+    start = time.perf_counter()
+    if mode == 'full':
+        with open(path, 'rb') as file:
+            data = json.loads(file.read())
+        records = list(transform_records(data, 'advertiser_id', 1001))
+    else:
+        file = open(path, 'rb')
+        records = transform_records(
+            iter_json_array(iter(lambda: file.read(CHUNK_SIZE), b'')), 'advertiser_id', 1001)
+    count = 0
+    for _ in records:
+        count += 1
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({'mode': mode, 'records': count, 'seconds': round(elapsed, 2),
+                      'peak_rss_mb': round(peak_mb, 1)}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--transactions', type=int, default=500000)
+    parser.add_argument('--mode', choices=['full', 'stream'])
+    parser.add_argument('--file')
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.file)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'transactions.json')
+        write_window(path, args.transactions)
+        print('window: {} transactions, {:.1f} MB'.format(
+            args.transactions, os.path.getsize(path) / 1024 / 1024))
+        # Each mode in a fresh process, so that the peak RSS is not shared
+        for mode in ('full', 'stream'):
+            subprocess.run([sys.executable, __file__, '--mode', mode, '--file', path], check=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+# Compare the output formats end-to-end against the local fake Awin API: Singer records
+# on stdout (encoded with orjson or simplejson) and Parquet or Arrow record files
+# (requires pyarrow). The time of a target parsing the output is not included.
+#
+# Usage: python benchmarks/bench_output.py [--accounts 3] [--transactions 50000]
+#            [--days 365] [--compression zstd]
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# pylint: disable=wrong-import-position
+from bench_e2e import add_arguments, run_benchmark
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    parser.add_argument('--compression', default='zstd')
+    parser.set_defaults(transactions=50000, streams='accounts,transactions')
+    args = parser.parse_args()
+
+    outputs = [
+        ('singer', {'fast_json': True}),
+        ('simplejson', {'fast_json': False}),
+        ('parquet', {'output_format': 'parquet', 'output_compression': args.compression}),
+        ('arrow', {'output_format': 'arrow', 'output_compression': args.compression}),
+    ]
+
+    print('{:<11} {:>8} {:>8} {:>10} {:>8} {:>10} {:>8}'.format(
+        'output', 'wall s', 'records', 'records/s', 'cpu s', 'output MB', 'RSS MB'))
+    for name, config in outputs:
+        results = run_benchmark(args, config)
+        print('{:<11} {:>8.2f} {:>8} {:>10.0f} {:>8.2f} {:>10.1f} {:>8.1f}'.format(
+            name,
+            results['wall_seconds'],
+            results['records'],
+            results['records_per_second'],
+            results['cpu_seconds'],
+            results['output_mb'],
+            results['peak_rss_mb']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# Cold start benchmark: wall time of fresh tap processes (the orchestrator may start the
+# tap many times a day), median and minimum of --runs runs per scenario:
+#   python:   the interpreter alone (baseline)
+#   import:   import tap_awin_advertiser
+#   discover: tap --discover
+#   sync:     tap with a catalog without selected streams (the imports and setup of a sync,
+#             no requests)
+# With --importtime, the modules with the largest cumulative import time of a sync are listed
+# (python -X importtime).
+# With --max-ms, the script fails (exit code 1) if the median of a tap scenario exceeds it,
+# e.g. in CI.
+#
+# Usage: python benchmarks/bench_startup.py [--runs 10] [--importtime 15] [--max-ms 1000]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+TAP_COMMAND = 'import tap_awin_advertiser; tap_awin_advertiser.main()'
+
+
+def run(command, env):
+    start = time.perf_counter()
+    subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                   env=env, check=True)
+    return (time.perf_counter() - start) * 1000.0
+
+
+# Modules with the largest cumulative import time (microseconds) of the command
+def import_times(command, env, top):
+    result = subprocess.run(
+        [command[0], '-X', 'importtime'] + command[1:],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env, check=True)
+    times = []
+    for line in result.stderr.decode('utf-8', 'replace').splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        times.append((int(cumulative), module.rstrip()))
+    return sorted(times, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--importtime', type=int, default=0,
+                        help='list this many modules with the largest import time of a sync')
+    parser.add_argument('--max-ms', type=float,
+                        help='fail if the median of a tap scenario is slower')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [REPO_DIR, env.get('PYTHONPATH')]))
+    work_dir = tempfile.mkdtemp(prefix='tap-awin-startup-')
+    config_path = os.path.join(work_dir, 'config.json')
+    with open(config_path, 'w') as file:
+        json.dump({'oauth2_token': 'benchmark', 'base_url': 'http://127.0.0.1:9'}, file)
+    catalog_path = os.path.join(work_dir, 'catalog.json')
+    with open(catalog_path, 'wb') as file:
+        file.write(subprocess.run(
+            [sys.executable, '-c', TAP_COMMAND, '--config', config_path, '--discover'],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env,
+            check=True).stdout)
+
+    tap = [sys.executable, '-c', TAP_COMMAND, '--config', config_path]
+    scenarios = [
+        ('python', [sys.executable, '-c', 'pass']),
+        ('import', [sys.executable, '-c', 'import tap_awin_advertiser']),
+        ('discover', tap + ['--discover']),
+        ('sync', tap + ['--catalog', catalog_path]),
+    ]
+
+    failed = False
+    print('{:<10} {:>10} {:>10}'.format('scenario', 'median ms', 'min ms'))
+    for name, command in scenarios:
+        # The first run warms up the file system cache and the bytecode cache
+        run(command, env)
+        times = [run(command, env) for _ in range(args.runs)]
+        median = statistics.median(times)
+        print('{:<10} {:>10.1f} {:>10.1f}'.format(name, median, min(times)))
+        if args.max_ms and name != 'python' and median > args.max_ms:
+            failed = True
+
+    if args.importtime:
+        print()
+        print('{:>10}  {}'.format('import ms', 'module (sync)'))
+        for cumulative, module in import_times(scenarios[-1][1], env, args.importtime):
+            print('{:>10.1f}  {}'.format(cumulative / 1000.0, module))
+
+    if failed:
+        sys.exit('Startup slower than {} ms'.format(args.max_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# Transform decamelized transactions: singer.Transformer per record (as before) vs. the
+# schema-compiled tap_awin_advertiser.transform.RecordTransformer. That both return the same
+# records is checked by tests/test_transform.py.
+#
+# Usage: python benchmarks/bench_transform.py [--records 100000]
+import argparse
+import os
+import sys
+import time
+
+from singer import metadata, Transformer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from fake_data import fake_transaction
+from tap_awin_advertiser.schema import get_schemas
+from tap_awin_advertiser.transform import decamelize, RecordTransformer
+
+
+def singer_transform(record, schema, mdata):
+    with Transformer() as transformer:
+        return transformer.transform(record, schema, mdata)
+
+
+def bench(name, func, records):
+    start = time.perf_counter()
+    for record in records:
+        func(record)
+    elapsed = time.perf_counter() - start
+    print('  {:<10} {:>8.2f} s {:>12.0f} records/s'.format(name, elapsed, len(records) / elapsed))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=100000)
+    args = parser.parse_args()
+
+    schemas, field_metadata = get_schemas()
+    schema = schemas['transactions']
+    mdata = metadata.to_map(field_metadata['transactions'])
+    records = [decamelize(fake_transaction(1001, i)) for i in range(args.records)]
+    transformer = RecordTransformer(schema, mdata)
+    print('transactions: {} records'.format(len(records)))
+    singer_time = bench('singer', lambda record: singer_transform(record, schema, mdata), records)
+    compiled_time = bench('compiled', transformer.transform, records)
+    print('  speedup: {:.1f}x'.format(singer_time / compiled_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+# Local stand-in for the Awin API, serving synthetic camelCase payloads (fake_data) for
+#   /accounts
+#   /advertisers/{id}/publishers
+#   /advertisers/{id}/transactions/?startDate=...&endDate=...[&dateType=validation]
+#   /advertisers/{id}/reports/publisher?startDate=...&endDate=... (dates)
+# The transactions of each account are spread evenly over the last --days days, so any
+# date window returns the same records for every run.
+# Latency, 429 responses (with Retry-After) and 503 responses can be injected. With --gzip, responses are
+# gzip compressed for clients that accept it. Request counters (and the bytes sent) are
+# served at /_stats.
+#
+# The port is printed as the first line on stdout (use --port 0 for a free port).
+#
+# Usage: python benchmarks/fake_awin_server.py [--port 8765] [--accounts 3]
+#            [--transactions 10000] [--days 365] [--publishers 50]
+#            [--latency-ms 0] [--rate-429 0.0] [--retry-after 1] [--rate-503 0.0] [--gzip]
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# pylint: disable=wrong-import-position
+from fake_data import fake_account, fake_publisher, fake_publisher_report, fake_transaction
+
+FIRST_ACCOUNT_ID = 1000
+FIRST_PUBLISHER_ID = 10000
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+REPORT_DATE_FORMAT = '%Y-%m-%d'
+
+
+class FakeAwinData:
+    def __init__(self, accounts, transactions, days, publishers):
+        self.account_ids = [FIRST_ACCOUNT_ID + i for i in range(accounts)]
+        self.transactions = transactions
+        self.publishers = publishers
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.start = today - timedelta(days=days)
+        # Seconds between two transactions of an account
+        self.step = days * 86400.0 / max(1, transactions)
+
+    def accounts(self):
+        return {
+            'userId': 1,
+            'accounts': [fake_account(account_id) for account_id in self.account_ids]
+        }
+
+    def account_publishers(self, advertiser_id):
+        return [fake_publisher(FIRST_PUBLISHER_ID + i) for i in range(self.publishers)]
+
+    # Transactions of the account with start <= transactionDate <= end
+    # (validationDate with date_type validation, the fake transactions are validated
+    # when they happen, or never)
+    def account_transactions(self, advertiser_id, start, end, date_type='transaction'):
+        index = self.account_ids.index(advertiser_id)
+        first = max(0, int(-(-(start - self.start).total_seconds() // self.step)))
+        last = min(self.transactions - 1, int((end - self.start).total_seconds() // self.step))
+        transactions = [
+            fake_transaction(
+                advertiser_id,
+                index * self.transactions + number + 1,
+                self.start + timedelta(seconds=int(number * self.step)))
+            for number in range(first, last + 1)
+        ]
+        if date_type == 'validation':
+            transactions = [
+                transaction for transaction in transactions if transaction['validationDate']]
+        return transactions
+
+    # Report rows of the transactions of the account from start to end (days, inclusive)
+    def publisher_report(self, advertiser_id, start, end):
+        return fake_publisher_report(
+            advertiser_id,
+            self.account_transactions(
+                advertiser_id, start, end + timedelta(days=1) - timedelta(seconds=1)))
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.failed = 0
+        self.bytes = 0
+
+    def add(self, throttled=False, failed=False, body_bytes=0):
+        with self.lock:
+            self.requests += 1
+            self.throttled += 1 if throttled else 0
+            self.failed += 1 if failed else 0
+            self.bytes += body_bytes
+
+    def asdict(self):
+        with self.lock:
+            return {'requests': self.requests, 'throttled': self.throttled,
+                    'failed': self.failed, 'bytes': self.bytes}
+
+
+def make_handler(data, stats, latency, rate_429, retry_after, seed, compress=False,
+                 rate_503=0.0):
+    rand = random.Random(seed)
+    rand_lock = threading.Lock()
+
+    class FakeAwinHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args): # pylint: disable=redefined-builtin
+            pass
+
+        def send_json(self, status, body, headers=None):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            if compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                payload = gzip.compress(payload, 6)
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(payload)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+            return len(payload)
+
+        def do_GET(self): # pylint: disable=invalid-name
+            url = urlparse(self.path)
+            parts = url.path.strip('/').split('/')
+            if parts == ['_stats']:
+                self.send_json(200, stats.asdict())
+                return
+
+            if latency:
+                time.sleep(latency)
+
+            if rate_429:
+                with rand_lock:
+                    throttle = rand.random() < rate_429
+                if throttle:
+                    stats.add(throttled=True)
+                    self.send_json(
+                        429,
+                        {'error': 'Requests limit exceeded'},
+                        {'Retry-After': str(retry_after)})
+                    return
+
+            if rate_503:
+                with rand_lock:
+                    fail = rand.random() < rate_503
+                if fail:
+                    stats.add(failed=True)
+                    self.send_json(503, {'error': 'Service unavailable'})
+                    return
+
+            try:
+                if parts == ['accounts']:
+                    body = data.accounts()
+                elif len(parts) == 3 and parts[0] == 'advertisers' and \
+                        parts[2] == 'publishers':
+                    body = data.account_publishers(int(parts[1]))
+                elif len(parts) == 3 and parts[0] == 'advertisers' and \
+                        parts[2] == 'transactions':
+                    query = parse_qs(url.query)
+                    body = data.account_transactions(
+                        int(parts[1]),
+                        datetime.strptime(query['startDate'][0], DATE_FORMAT),
+                        datetime.strptime(query['endDate'][0], DATE_FORMAT),
+                        query.get('dateType', ['transaction'])[0])
+                elif len(parts) == 4 and parts[0] == 'advertisers' and \
+                        parts[2:] == ['reports', 'publisher']:
+                    query = parse_qs(url.query)
+                    body = data.publisher_report(
+                        int(parts[1]),
+                        datetime.strptime(query['startDate'][0], REPORT_DATE_FORMAT),
+                        datetime.strptime(query['endDate'][0], REPORT_DATE_FORMAT))
+                else:
+                    stats.add()
+                    self.send_json(404, {'error': 'Not found: {}'.format(url.path)})
+                    return
+            except (KeyError, ValueError) as err:
+                stats.add()
+                self.send_json(400, {'error': 'Bad request: {}'.format(err)})
+                return
+
+            stats.add(body_bytes=self.send_json(200, body))
+
+    return FakeAwinHandler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--accounts', type=int, default=3)
+    parser.add_argument('--transactions', type=int, default=10000,
+                        help='transactions per account')
+    parser.add_argument('--days', type=int, default=365,
+                        help='the transactions are spread over the last days')
+    parser.add_argument('--publishers', type=int, default=50,
+                        help='publishers per account')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--rate-429', type=float, default=0.0,
+                        help='fraction of requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--rate-503', type=float, default=0.0,
+                        help='fraction of requests answered with 503')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--gzip', action='store_true', help='compress the responses')
+    args = parser.parse_args()
+
+    data = FakeAwinData(args.accounts, args.transactions, args.days, args.publishers)
+    stats = Stats()
+    handler = make_handler(
+        data, stats, args.latency_ms / 1000.0, args.rate_429, args.retry_after, args.seed,
+        args.gzip, args.rate_503)
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    print(server.server_address[1], flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
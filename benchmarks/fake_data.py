@@ -0,0 +1,113 @@
+# Synthetic Awin API payloads (camelCase, as returned by the API) for the benchmarks
+from datetime import datetime, timedelta
+
+BASE_DATE = datetime(2020, 1, 1)
+
+
+def fake_account(account_id):
+    return {
+        'accountId': account_id,
+        'accountName': 'Advertiser {}'.format(account_id),
+        'accountType': 'advertiser',
+        'userRole': 'admin'
+    }
+
+
+def fake_publisher(publisher_id):
+    return {
+        'id': publisher_id,
+        'name': 'Publisher {}'.format(publisher_id),
+        'primaryRegion': 'DE',
+        'salesRegions': ['DE', 'AT', 'CH'],
+        'primaryType': 'content'
+    }
+
+
+def fake_transaction(advertiser_id, transaction_id, transaction_date=None):
+    if transaction_date is None:
+        transaction_date = BASE_DATE + timedelta(minutes=transaction_id % 500000)
+    date_str = transaction_date.strftime('%Y-%m-%dT%H:%M:%S')
+    click_str = (transaction_date - timedelta(hours=3)).strftime('%Y-%m-%dT%H:%M:%S')
+    amount = round(10 + (transaction_id % 997) * 0.37, 2)
+    commission = round(amount * 0.08, 2)
+    return {
+        'id': transaction_id,
+        'url': 'https://www.example.com/product/{}'.format(transaction_id % 1000),
+        'advertiserId': advertiser_id,
+        'publisherId': 10000 + transaction_id % 300,
+        'commissionSharingPublisherId': None,
+        'commissionSharingSelectedRatePublisherId': None,
+        'siteName': 'Publisher site {}'.format(transaction_id % 300),
+        'commissionStatus': ('pending', 'approved', 'declined')[transaction_id % 3],
+        'commissionAmount': {'amount': commission, 'currency': 'EUR'},
+        'saleAmount': {'amount': amount, 'currency': 'EUR'},
+        'ipHash': '5f1d{:012x}'.format(transaction_id),
+        'customerCountry': 'DE',
+        'clickRefs': {'clickRef': 'ref{}'.format(transaction_id % 50), 'clickRef2': None},
+        'clickDate': click_str,
+        'transactionDate': date_str,
+        'validationDate': date_str if transaction_id % 3 else None,
+        'type': 'Commission group transaction',
+        'declineReason': None,
+        'voucherCodeUsed': transaction_id % 7 == 0,
+        'voucherCode': 'SUMMER' if transaction_id % 7 == 0 else None,
+        'lapseTime': 10800,
+        'amended': False,
+        'amendReason': None,
+        'oldSaleAmount': None,
+        'oldCommissionAmount': None,
+        'clickDevice': 'Windows',
+        'transactionDevice': 'Windows',
+        'publisherUrl': 'https://publisher.example.com',
+        'advertiserCountry': 'DE',
+        'orderRef': 'ORDER-{}'.format(transaction_id),
+        'customParameters': [{'key': 'basket', 'value': str(transaction_id % 5)}],
+        'transactionParts': [{
+            'commissionGroupId': 1234,
+            'amount': amount,
+            'commissionAmount': commission,
+            'advertiserCost': None,
+            'commissionGroupCode': 'DEFAULT',
+            'commissionGroupName': 'Default Commission'
+        }],
+        'paidToPublisher': False,
+        'paymentId': 0,
+        'transactionQueryId': 0,
+        'originalSaleAmount': None,
+        'advertiserCost': {'amount': None, 'currency': None}
+    }
+
+
+# Rows of the publisher performance report (per publisher) aggregated from the transactions
+def fake_publisher_report(advertiser_id, transactions):
+    rows = {}
+    for transaction in transactions:
+        publisher_id = transaction['publisherId']
+        row = rows.get(publisher_id)
+        if row is None:
+            row = rows[publisher_id] = {
+                'advertiserId': advertiser_id,
+                'advertiserName': 'Advertiser {}'.format(advertiser_id),
+                'publisherId': publisher_id,
+                'publisherName': 'Publisher {}'.format(publisher_id),
+                'region': 'DE',
+                'currency': 'EUR',
+                'impressions': 0,
+                'clicks': 0,
+                'tags': None
+            }
+            for prefix in ('pending', 'confirmed', 'bonus', 'total', 'declined'):
+                row[prefix + 'No'] = 0
+                row[prefix + 'Value'] = 0.0
+                row[prefix + 'Comm'] = 0.0
+        status = {'approved': 'confirmed'}.get(
+            transaction['commissionStatus'], transaction['commissionStatus'])
+        row['clicks'] += 1
+        row['impressions'] += 20
+        for prefix in (status, 'total'):
+            row[prefix + 'No'] += 1
+            row[prefix + 'Value'] = round(
+                row[prefix + 'Value'] + transaction['saleAmount']['amount'], 2)
+            row[prefix + 'Comm'] = round(
+                row[prefix + 'Comm'] + transaction['commissionAmount']['amount'], 2)
+    return list(rows.values())
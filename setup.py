@@ -11,13 +11,13 @@ setup(name='tap-awin-advertiser',
       py_modules=['tap_awin_advertiser'],
       install_requires=[
           'singer-python==5.9.0',
-          'backoff==1.8.0',
           'requests==2.24.0',
           'pyhumps==1.6.1'
       ],
       entry_points='''
           [console_scripts]
           tap-awin-advertiser=tap_awin_advertiser:main
+          tap-awin-advertiser-merge-states=tap_awin_advertiser.sharding:main
       ''',
       packages=find_packages(),
       package_data = {
@@ -26,9 +26,19 @@ setup(name='tap-awin-advertiser',
           ],
       },
       extras_require={
+          'fast': [
+              'orjson',
+          ],
+          'async': [
+              'aiohttp',
+          ],
+          'parquet': [
+              'pyarrow',
+          ],
           'dev': [
               'pylint',
               'ipdb',
+              'pytest',
           ]
       },
 )
\ No newline at end of file
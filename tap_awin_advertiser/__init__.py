@@ -1,13 +1,11 @@
 #!/usr/bin/env python3
 import sys
 import json
-import requests
+import signal
 
 import singer
 
-from tap_awin_advertiser.client import AwinClient
 from tap_awin_advertiser.discover import discover
-from tap_awin_advertiser.sync import sync
 
 LOGGER = singer.get_logger()
 
@@ -21,29 +19,97 @@ def do_discover():
     json.dump(catalog.to_dict(), sys.stdout, indent=2)
     LOGGER.info('Finished discover')
 
+# Maximum number of concurrent requests of the sync
+def get_concurrency(config):
+    from tap_awin_advertiser.client import DEFAULT_ASYNC_CONCURRENCY
+    if config.get('engine', 'threads') == 'async':
+        return int(config.get('async_concurrency', DEFAULT_ASYNC_CONCURRENCY))
+    return int(config.get('max_workers', 1)) * int(config.get('window_workers', 1))
+
+# Stop the sync with an exception on SIGTERM, so that the latest state is still written
+def handle_sigterm(signum, frame):
+    raise SystemExit('Received signal {}, stopping'.format(signum))
+
+# The modules of the sync (requests, ...) are imported here, not at startup, so that
+# discovery does not load them
+def do_sync(config, catalog, state):
+    from tap_awin_advertiser.cache import ResponseCache
+    from tap_awin_advertiser.client import AwinClient, API_URL, DEFAULT_POOL_SIZE
+    from tap_awin_advertiser.profiling import PROFILER
+    from tap_awin_advertiser.rate_limiter import DEFAULT_REQUESTS_PER_MINUTE
+    from tap_awin_advertiser.retry import (
+        RetryPolicy, DEFAULT_MAX_TRIES, DEFAULT_MAX_DELAY, DEFAULT_RETRY_BUDGET_SECONDS,
+        DEFAULT_BREAKER_THRESHOLD, DEFAULT_BREAKER_COOLDOWN)
+    from tap_awin_advertiser.sync import sync
+
+    cache = None
+    if config.get('cache_dir'):
+        cache = ResponseCache(config['cache_dir'], config.get('cache_replay', False))
+
+    # config max_tries, retry_max_delay, retry_budget_seconds: retries of failed requests
+    # config circuit_breaker_threshold, circuit_breaker_cooldown: circuit breaker per endpoint
+    # One policy for the run, shared by the clients of both engines
+    retry_policy = RetryPolicy(
+        max_tries=config.get('max_tries', DEFAULT_MAX_TRIES),
+        max_delay=config.get('retry_max_delay', DEFAULT_MAX_DELAY),
+        budget_seconds=config.get('retry_budget_seconds', DEFAULT_RETRY_BUDGET_SECONDS),
+        breaker_threshold=config.get('circuit_breaker_threshold', DEFAULT_BREAKER_THRESHOLD),
+        breaker_cooldown=config.get('circuit_breaker_cooldown', DEFAULT_BREAKER_COOLDOWN))
+
+    client_args = {
+        'oauth2_token': config['oauth2_token'],
+        'user_agent': config.get('user_agent',None),
+        'requests_per_minute': config.get(
+            'requests_per_minute', DEFAULT_REQUESTS_PER_MINUTE),
+        'rate_limit_burst': config.get('rate_limit_burst', 1),
+        'cache': cache,
+        'base_url': config.get('base_url', API_URL),
+        # config pool_size: connections kept alive, default: one per concurrent request
+        'pool_size': int(config.get(
+            'pool_size', max(DEFAULT_POOL_SIZE, get_concurrency(config)))),
+        # config keep_alive: reuse connections (HTTP keep-alive)
+        'keep_alive': config.get('keep_alive', True),
+        'retry_policy': retry_policy
+    }
+
+    # config profile: log the time (and memory block delta) per stream and stage as metrics
+    # config profile_output: also profile the run with cProfile, stats file (pstats)
+    PROFILER.configure(config.get('profile', False), config.get('profile_output'))
+    PROFILER.start()
+    try:
+        # config engine: 'threads' (default, requests) or 'async' (asyncio, aiohttp)
+        if config.get('engine', 'threads') == 'async':
+            # aiohttp is an optional dependency; the async client is opened in the event loop
+            from tap_awin_advertiser.async_sync import run_sync_async
+            run_sync_async(client_args, config, catalog, state)
+        else:
+            with AwinClient(**client_args) as client:
+                sync(client=client,
+                     config=config,
+                     catalog=catalog,
+                     state=state)
+    finally:
+        PROFILER.stop()
+        retry_policy.log_metrics()
+
 @singer.utils.handle_top_exception(LOGGER)
 def main():
+    signal.signal(signal.SIGTERM, handle_sigterm)
 
     parsed_args = singer.utils.parse_args(REQUIRED_CONFIG_KEYS)
 
-    with AwinClient(parsed_args.config['oauth2_token'],
-                    parsed_args.config.get('user_agent',None)) as client:
-
-        state = {}
-        if parsed_args.state:
-            state = parsed_args.state
+    state = {}
+    if parsed_args.state:
+        state = parsed_args.state
 
-        config = {}
-        if parsed_args.config:
-            config = parsed_args.config
+    config = {}
+    if parsed_args.config:
+        config = parsed_args.config
 
-        if parsed_args.discover:
-            do_discover()
-        elif parsed_args.catalog:
-            sync(client=client,
-                 config=config,
-                 catalog=parsed_args.catalog,
-                 state=state)
+    if parsed_args.discover:
+        do_discover()
+    elif parsed_args.catalog:
+        do_sync(config, parsed_args.catalog, state)
 
 if __name__ == '__main__':
     main()
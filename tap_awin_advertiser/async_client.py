@@ -0,0 +1,201 @@
+import asyncio
+import json
+import time
+
+import aiohttp
+import singer
+from singer import metrics
+
+from tap_awin_advertiser.cache import NO_CACHE
+from tap_awin_advertiser.client import (
+    API_URL, ACCEPT_ENCODING, DEFAULT_ASYNC_CONCURRENCY, Server5xxError, Server429Error,
+    AwinError, raise_for_error_content)
+from tap_awin_advertiser.profiling import PROFILER, RATE_LIMIT, HTTP, CACHE, JSON_DECODE
+from tap_awin_advertiser.rate_limiter import (
+    RateLimiter, DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_RETRY_AFTER, parse_retry_after)
+from tap_awin_advertiser.retry import RetryPolicy
+
+LOGGER = singer.get_logger()
+
+# Errors after which a request is retried (like AwinClient.request)
+RETRY_EXCEPTIONS = (Server5xxError, aiohttp.ClientConnectionError, Server429Error)
+
+
+# asyncio version of AwinClient, based on aiohttp, with the same error mapping, retries,
+# rate limiting and response cache. The session is opened in the event loop:
+#   async with AsyncAwinClient(...) as client:
+#       data = await client.get(url, endpoint=stream_name)
+# Response bodies are read as a whole (no stream_json); cache entries are read and
+# written synchronously, they are small compared to the requests.
+class AsyncAwinClient:
+    def __init__(self,
+                 oauth2_token,
+                 user_agent=None,
+                 requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 rate_limit_burst=1,
+                 cache=None,
+                 base_url=API_URL,
+                 pool_size=None,
+                 keep_alive=True,
+                 concurrency=DEFAULT_ASYNC_CONCURRENCY,
+                 retry_policy=None):
+        self.__oauth2_token = oauth2_token
+        self.__user_agent = user_agent
+        self.__session = None
+        self.__semaphore = None
+        self.concurrency = max(1, int(concurrency))
+        self.__pool_size = pool_size or self.concurrency
+        self.__keep_alive = keep_alive
+        # endpoint: [bytes received (compressed), bytes decompressed]
+        self.__transfer = {}
+        # requests_per_minute = 0 disables client side rate limiting
+        self.__rate_limiter = None
+        if requests_per_minute:
+            self.__rate_limiter = RateLimiter(requests_per_minute, rate_limit_burst)
+        # Optional ResponseCache for GET requests with a cache_ttl
+        self.__cache = cache
+        # Retries, retry budget and circuit breakers (retry.py), may be shared by clients
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.base_url = base_url.rstrip('/')
+
+    async def __aenter__(self):
+        headers = {
+            'Authorization': 'Bearer {}'.format(self.__oauth2_token),
+            'Accept-Encoding': ACCEPT_ENCODING
+        }
+        if self.__user_agent:
+            headers['User-Agent'] = self.__user_agent
+        self.__semaphore = asyncio.Semaphore(self.concurrency)
+        self.__session = aiohttp.ClientSession(
+            headers=headers,
+            connector=aiohttp.TCPConnector(
+                limit=self.__pool_size,
+                force_close=not self.__keep_alive))
+        return self
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        await self.__session.close()
+        if self.__rate_limiter:
+            self.__rate_limiter.log_metrics()
+        if self.__cache:
+            self.__cache.log_metrics()
+        for endpoint, (received_bytes, decompressed_bytes) in self.__transfer.items():
+            tags = {metrics.Tag.endpoint: endpoint}
+            metrics.log(LOGGER, metrics.Point(
+                'counter', 'http_response_bytes', received_bytes, tags))
+            metrics.log(LOGGER, metrics.Point(
+                'counter', 'http_response_decompressed_bytes', decompressed_bytes, tags))
+
+    # Returns the body of the response, retried as the retry_policy allows.
+    # response_info: optional dict, gets 'server_seconds' (see AwinClient.request)
+    async def request(self, method, url, endpoint=None, response_info=None, **kwargs):
+        self.retry_policy.check(endpoint)
+        tries = 0
+        while True:
+            tries += 1
+            try:
+                body = await self.__request(method, url, endpoint, response_info, **kwargs)
+            except Exception as err:
+                wait = None
+                if isinstance(err, RETRY_EXCEPTIONS):
+                    wait = self.retry_policy.retry_delay(endpoint, tries, err)
+                if wait is None:
+                    # Server errors and connection errors count as failures of the endpoint
+                    self.retry_policy.record(endpoint, isinstance(
+                        err, (Server5xxError, aiohttp.ClientConnectionError)))
+                    raise
+                LOGGER.info('Backing off request(...) for {:.1f}s ({})'.format(
+                    wait, type(err).__name__))
+                await asyncio.sleep(wait)
+                continue
+            self.retry_policy.record(endpoint, False)
+            return body
+
+    async def __request(self, method, url, endpoint, response_info, **kwargs):
+        if self.__rate_limiter:
+            wait = self.__rate_limiter.reserve(endpoint)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                if PROFILER.enabled:
+                    PROFILER.add(endpoint, RATE_LIMIT, wait)
+
+        async with self.__semaphore:
+            request_start = time.perf_counter()
+            with metrics.http_request_timer(endpoint) as timer:
+                async with self.__session.request(method, url, **kwargs) as response:
+                    # Until the response headers, like requests' Response.elapsed
+                    server_seconds = time.perf_counter() - request_start
+                    timer.tags[metrics.Tag.http_status_code] = response.status
+                    status_code = response.status
+                    headers = response.headers
+                    reason = response.reason
+                    body = await response.read()
+            # aiohttp does not count the received bytes, the Content-Length of the
+            # (compressed) body is used if the server sends it
+            transfer = self.__transfer.setdefault(endpoint, [0, 0])
+            transfer[0] += int(headers.get('Content-Length', len(body)))
+            transfer[1] += len(body)
+            if PROFILER.enabled:
+                PROFILER.add(endpoint, HTTP, time.perf_counter() - request_start)
+
+        if status_code >= 500:
+            raise Server5xxError()
+
+        if status_code == 429:
+            retry_after = parse_retry_after(headers.get('Retry-After'))
+            try:
+                response_json = json.loads(body)
+                if response_json.get('error') == 'request.limit.exceeded':
+                    LOGGER.warning('Request limit exceeded: {}'.format(
+                        response_json.get('description')))
+            except Exception: # pylint: disable=broad-except
+                pass
+
+            # Without a Retry-After header we just wait 1 minute and try again.
+            # The pause applies to all requests of this client, not only this one.
+            if retry_after is None:
+                retry_after = DEFAULT_RETRY_AFTER
+            if self.__rate_limiter:
+                self.__rate_limiter.pause(retry_after)
+
+            raise Server429Error(retry_after)
+
+        if self.__rate_limiter:
+            self.__rate_limiter.update_from_headers(headers)
+
+        if status_code != 200:
+            LOGGER.error('{}: {}'.format(status_code, body.decode('utf-8', 'replace')))
+            if status_code >= 400:
+                error = AwinError(
+                    '{} Client Error: {} for url: {}'.format(status_code, reason, url))
+                raise_for_error_content(status_code, body, error)
+                # An error without a body is not returned (and cached) as a response
+                raise error
+
+        if response_info is not None:
+            response_info['server_seconds'] = server_seconds
+        return body
+
+    # cache_ttl: seconds the response may be served from the cache (see AwinClient.get)
+    async def get(self, url, endpoint=None, cache_ttl=NO_CACHE, response_info=None):
+        cache_path = None
+        # In replay mode all requests are served from the cache
+        if self.__cache is not None and (cache_ttl != NO_CACHE or self.__cache.replay):
+            cache_path = self.__cache.lookup(url, None, cache_ttl, endpoint)
+
+        if cache_path:
+            with PROFILER.stage(endpoint, CACHE):
+                body = self.__cache.read(cache_path)
+        else:
+            body = await self.request(
+                'GET', url, endpoint=endpoint, response_info=response_info)
+            if self.__cache is not None and cache_ttl != NO_CACHE:
+                with PROFILER.stage(endpoint, CACHE):
+                    self.__cache.write(url, body)
+
+        with PROFILER.stage(endpoint, JSON_DECODE):
+            try:
+                return json.loads(body)
+            except ValueError as err:
+                LOGGER.error('{}'.format(err))
+                raise Exception(err)
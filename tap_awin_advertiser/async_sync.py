@@ -0,0 +1,230 @@
+import asyncio
+from collections import deque
+
+import singer
+from singer import utils
+
+from tap_awin_advertiser.async_client import AsyncAwinClient
+from tap_awin_advertiser.client import DEFAULT_ASYNC_CONCURRENCY
+from tap_awin_advertiser.retry import CircuitOpenError
+from tap_awin_advertiser.streams import STREAMS
+from tap_awin_advertiser.sync import (
+    EndpointSync, prepare_sync, finish_sync, finish_output, write_schema, update_currently_syncing,
+    get_validation_pass, DEFERRED_TRIES)
+
+LOGGER = singer.get_logger()
+
+
+# asyncio version of sync_endpoint: the date windows are fetched concurrently
+# (config window_workers) and processed in order, child streams are synced for all
+# parent ids concurrently, limited by the concurrency of the client.
+async def sync_endpoint_async(
+        client,
+        config,
+        catalog,
+        state,
+        stream_name,
+        endpoint_config,
+        sync_streams,
+        selected_streams,
+        parent_id=None):
+
+    endpoint = EndpointSync(
+        client, config, catalog, state, stream_name, endpoint_config,
+        sync_streams, selected_streams, parent_id)
+
+    # Fetch the API data of a date window
+    async def fetch_window(window):
+        url, cache_ttl = endpoint.window_request(window)
+        response_info = {}
+        try:
+            window_data = await client.get(
+                url, endpoint=stream_name, cache_ttl=cache_ttl, response_info=response_info)
+        except CircuitOpenError:
+            # Failed fast, the parent id may be deferred (sync_child_endpoints_async)
+            raise
+        except Exception as err:
+            LOGGER.error('{}'.format(err))
+            LOGGER.error('URL for Stream {}: {}'.format(stream_name, url))
+            raise Exception(err)
+
+        # time_extracted: datetime when the data was extracted from the API
+        return window, window_data, utils.now(), response_info.get('server_seconds', 0.0)
+
+    # Up to window_workers windows are fetched while the current window is processed
+    # (like fetch_in_order)
+    windows = iter(endpoint.windows())
+    pending = deque()
+    try:
+        while True:
+            while len(pending) < endpoint.window_workers:
+                window = next(windows, None)
+                if window is None:
+                    break
+                pending.append(asyncio.ensure_future(fetch_window(window)))
+            if not pending:
+                break
+
+            window, data, time_extracted, server_seconds = await pending.popleft()
+            records = endpoint.process_data(data, time_extracted, window)
+
+            if records is not None:
+                for child_stream_name, child_endpoint_config in endpoint.child_streams():
+                    LOGGER.info('START Syncing: {}'.format(child_stream_name))
+                    write_schema(catalog, child_stream_name)
+                    await sync_child_endpoints_async(
+                        client=client,
+                        config=config,
+                        catalog=catalog,
+                        state=state,
+                        stream_name=child_stream_name,
+                        endpoint_config=child_endpoint_config,
+                        sync_streams=sync_streams,
+                        selected_streams=selected_streams,
+                        parent_stream_name=stream_name,
+                        parent_ids=endpoint.parent_ids(records))
+
+            endpoint.finish_window(window, records, server_seconds)
+    finally:
+        # Do not fetch the remaining windows after an error
+        for task in pending:
+            task.cancel()
+
+    total_records = endpoint.finish()
+
+    validation_config = get_validation_pass(config, endpoint_config)
+    if validation_config and stream_name in sync_streams:
+        total_records = total_records + await sync_endpoint_async(
+            client=client,
+            config=config,
+            catalog=catalog,
+            state=state,
+            stream_name=stream_name,
+            endpoint_config=validation_config,
+            sync_streams=sync_streams,
+            selected_streams=selected_streams,
+            parent_id=parent_id)
+
+    return total_records
+
+
+# Sync a child endpoint for each of the parent ids, at most client.concurrency at once.
+# Parent ids that fail fast on an open circuit breaker are deferred (see sync_child_endpoints).
+async def sync_child_endpoints_async(
+        client,
+        config,
+        catalog,
+        state,
+        stream_name,
+        endpoint_config,
+        sync_streams,
+        selected_streams,
+        parent_stream_name,
+        parent_ids):
+
+    semaphore = asyncio.Semaphore(client.concurrency)
+
+    async def sync_parent_id(parent_id):
+        async with semaphore:
+            LOGGER.info('START Sync for Stream: {}, parent_stream: {}, parent_id: {}'.format(
+                stream_name, parent_stream_name, parent_id))
+
+            child_total_records = await sync_endpoint_async(
+                client=client,
+                config=config,
+                catalog=catalog,
+                state=state,
+                stream_name=stream_name,
+                endpoint_config=endpoint_config,
+                sync_streams=sync_streams,
+                selected_streams=selected_streams,
+                parent_id=parent_id)
+
+            LOGGER.info('FINISHED Sync for Stream: {}, parent_id: {}, total_records: {}'.format(
+                stream_name, parent_id, child_total_records))
+            return child_total_records
+
+    # (parent_id, endpoint of the open circuit)
+    deferred = []
+
+    async def sync_or_defer(parent_id):
+        try:
+            return await sync_parent_id(parent_id)
+        except CircuitOpenError as err:
+            LOGGER.warning('Stream: {}, parent_id: {}, deferred: {}'.format(
+                stream_name, parent_id, err))
+            deferred.append((parent_id, err.endpoint))
+            return 0
+
+    tasks = [asyncio.ensure_future(sync_or_defer(parent_id)) for parent_id in parent_ids]
+    try:
+        total_records = sum(await asyncio.gather(*tasks))
+    except BaseException:
+        # Do not continue the syncs of the other parent ids after an error
+        for task in tasks:
+            task.cancel()
+        raise
+
+    for parent_id, endpoint in deferred:
+        for tries in range(1, DEFERRED_TRIES + 1):
+            wait = client.retry_policy.open_seconds(endpoint)
+            if wait > 0:
+                LOGGER.info('Waiting {:.0f}s for the circuit breaker of endpoint {}'.format(
+                    wait, endpoint))
+                await asyncio.sleep(wait)
+            try:
+                total_records = total_records + await sync_parent_id(parent_id)
+                break
+            except CircuitOpenError as err:
+                endpoint = err.endpoint
+                if tries == DEFERRED_TRIES:
+                    LOGGER.warning('Stream: {}, parent_id: {}, skipped: {}'.format(
+                        stream_name, parent_id, err))
+    return total_records
+
+
+async def sync_async(client, config, catalog, state):
+    sync_streams, selected_streams = prepare_sync(config, catalog, state)
+    if not sync_streams:
+        return
+
+    try:
+        for stream_name, endpoint_config in STREAMS.items():
+            if stream_name in sync_streams:
+                LOGGER.info('START Syncing: {}'.format(stream_name))
+                write_schema(catalog, stream_name)
+                update_currently_syncing(state, stream_name)
+
+                total_records = await sync_endpoint_async(
+                    client=client,
+                    config=config,
+                    catalog=catalog,
+                    state=state,
+                    stream_name=stream_name,
+                    endpoint_config=endpoint_config,
+                    sync_streams=sync_streams,
+                    selected_streams=selected_streams)
+
+                update_currently_syncing(state, None)
+                LOGGER.info('FINISHED Syncing: {}, total_records: {}'.format(
+                    stream_name,
+                    total_records))
+
+        finish_sync(state)
+    finally:
+        # Write the latest state also if the sync failed, it only contains
+        # bookmarks of finished date windows
+        finish_output(state)
+
+
+# Run the sync with the asyncio engine
+# client_args: arguments of AwinClient, used for the AsyncAwinClient
+# config async_concurrency: maximum number of requests in flight and parents synced at once
+def run_sync_async(client_args, config, catalog, state):
+    async def run():
+        async with AsyncAwinClient(
+                concurrency=config.get('async_concurrency', DEFAULT_ASYNC_CONCURRENCY),
+                **client_args) as client:
+            await sync_async(client, config, catalog, state)
+
+    asyncio.run(run())
@@ -0,0 +1,135 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import singer
+from singer import metrics
+
+LOGGER = singer.get_logger()
+
+# cache_ttl values (seconds) of the requests
+CACHE_FOREVER = -1
+NO_CACHE = 0
+
+# Default cache_ttl per endpoint (stream), for responses that may still change.
+# Date windows of transactions before the attribution window are cached forever.
+DEFAULT_CACHE_TTL = {
+    'accounts': 3600,
+    'publishers': 86400,
+    'transactions': 3600,
+    'publisher_performance_report': 3600
+}
+
+CHUNK_SIZE = 65536
+
+
+class CacheMissError(Exception):
+    pass
+
+
+# On-disk cache of API response bodies, stored gzip compressed.
+# Entries are keyed by URL and request params; the age of an entry is its file modification time.
+# In replay mode all requests are served from the cache (regardless of their age) and a
+# missing entry is an error, so a sync can be repeated without calling the API.
+class ResponseCache:
+    def __init__(self, cache_dir, replay=False):
+        self.cache_dir = cache_dir
+        self.replay = replay
+        os.makedirs(cache_dir, exist_ok=True)
+        self.__lock = threading.Lock()
+        # endpoint: [hits, misses]
+        self.__stats = {}
+
+    def __path(self, url, params=None):
+        key = url
+        if params:
+            key = '{}#{}'.format(url, json.dumps(params, sort_keys=True))
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], '{}.json.gz'.format(digest))
+
+    def __count(self, endpoint, hit):
+        with self.__lock:
+            stats = self.__stats.setdefault(endpoint, [0, 0])
+            stats[0 if hit else 1] += 1
+
+    # Path of a valid cache entry, or None
+    def lookup(self, url, params=None, ttl=CACHE_FOREVER, endpoint=None):
+        path = self.__path(url, params)
+        try:
+            age = time.time() - os.path.getmtime(path)
+        except OSError:
+            age = None
+
+        if age is not None and (self.replay or ttl < 0 or age <= ttl):
+            self.__count(endpoint, True)
+            return path
+
+        self.__count(endpoint, False)
+        if self.replay:
+            raise CacheMissError('Response not in cache (replay mode): {}'.format(url))
+        return None
+
+    @staticmethod
+    def read(path):
+        with gzip.open(path, 'rb') as file:
+            return file.read()
+
+    @staticmethod
+    def read_chunks(path):
+        with gzip.open(path, 'rb') as file:
+            while True:
+                chunk = file.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    def write(self, url, body, params=None):
+        self.tee(url, [body], params).consume()
+
+    # Write the chunks to the cache while they are passed through.
+    # The entry is only stored if all chunks were read.
+    def tee(self, url, chunks, params=None):
+        return CacheWriter(self.__path(url, params), chunks)
+
+    def log_metrics(self):
+        with self.__lock:
+            stats = dict(self.__stats)
+        for endpoint, (hits, misses) in stats.items():
+            tags = {metrics.Tag.endpoint: endpoint}
+            metrics.log(LOGGER, metrics.Point('counter', 'http_cache_hits', hits, tags))
+            metrics.log(LOGGER, metrics.Point('counter', 'http_cache_misses', misses, tags))
+
+
+class CacheWriter:
+    def __init__(self, path, chunks):
+        self.__path = path
+        self.__chunks = chunks
+
+    def __iter__(self):
+        directory = os.path.dirname(self.__path)
+        os.makedirs(directory, exist_ok=True)
+        # Written to a temporary file first, so that readers never see partial entries
+        file_descriptor, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        committed = False
+        try:
+            with os.fdopen(file_descriptor, 'wb') as raw_file, \
+                    gzip.GzipFile(fileobj=raw_file, mode='wb') as file:
+                for chunk in self.__chunks:
+                    file.write(chunk)
+                    yield chunk
+            os.replace(tmp_path, self.__path)
+            committed = True
+        finally:
+            if not committed:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    def consume(self):
+        for _ in self:
+            pass
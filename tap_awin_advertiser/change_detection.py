@@ -0,0 +1,163 @@
+import base64
+import bisect
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zlib
+from array import array
+
+import singer
+
+from tap_awin_advertiser.dedup import id_key
+
+LOGGER = singer.get_logger()
+
+# Field of the tombstone records of deleted rows, added to the schema of the streams with
+# change detection if tombstones are written
+DELETED_AT_FIELD = '_sdc_deleted_at'
+DELETED_AT_SCHEMA = {
+    'type': ['null', 'string'],
+    'format': 'date-time',
+    'description': 'time the record was no longer returned (tombstone)'
+}
+
+
+# 64 bit hash of a (transformed) record
+def fingerprint(record):
+    data = json.dumps(record, sort_keys=True, separators=(',', ':'), default=str)
+    digest = hashlib.blake2b(data.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+# Fingerprints of the records of one parent, as two parallel arrays of 64 bit integers
+# sorted by id (about 16 bytes per record, instead of a dict entry of ~150 bytes).
+# The ids are the 64 bit keys of the record ids (dedup.id_key, other ids than integers
+# are hashed).
+# Encoded for the state (or the sidecar file) as compressed, base64 encoded string.
+class Fingerprints:
+    def __init__(self, ids=None, hashes=None):
+        self.ids = ids if ids is not None else array('q')
+        self.hashes = hashes if hashes is not None else array('q')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get(self, record_id):
+        key = id_key(record_id)
+        index = bisect.bisect_left(self.ids, key)
+        if index < len(self.ids) and self.ids[index] == key:
+            return self.hashes[index]
+        return None
+
+    # pairs: (record id, fingerprint)
+    @classmethod
+    def from_pairs(cls, pairs):
+        pairs = sorted((id_key(record_id), hash_value) for record_id, hash_value in pairs)
+        return cls(array('q', (record_id for record_id, _ in pairs)),
+                   array('q', (hash_value for _, hash_value in pairs)))
+
+    @classmethod
+    def decode(cls, value):
+        if not value:
+            return cls()
+        data = zlib.decompress(base64.b64decode(value))
+        size = len(data) // 2
+        ids = array('q')
+        ids.frombytes(data[:size])
+        hashes = array('q')
+        hashes.frombytes(data[size:])
+        return cls(ids, hashes)
+
+    def encode(self):
+        data = self.ids.tobytes() + self.hashes.tobytes()
+        return base64.b64encode(zlib.compress(data, 9)).decode('ascii')
+
+
+# Change detection for the records of one parent of a FULL_TABLE stream.
+# changed() is called for every record of the current sync (in any order); records with
+# the same fingerprint as in the previous sync are unchanged. The ids of the previous
+# sync that were not seen again are deleted (their keys, the ids themselves only if they
+# are integers: hashed_ids).
+class ChangeDetector:
+    def __init__(self, previous, key_field):
+        self.previous = previous
+        self.key_field = key_field
+        self.__pairs = []
+        self.unchanged = 0
+        self.hashed_ids = False
+
+    def changed(self, record):
+        record_id = record.get(self.key_field)
+        if not self.hashed_ids and id_key(record_id) != record_id:
+            self.hashed_ids = True
+        hash_value = fingerprint(record)
+        self.__pairs.append((record_id, hash_value))
+        if self.previous.get(record_id) == hash_value:
+            self.unchanged += 1
+            return False
+        return True
+
+    def fingerprints(self):
+        return Fingerprints.from_pairs(self.__pairs)
+
+    def deleted_ids(self, current=None):
+        current = current or self.fingerprints()
+        return [record_id for record_id in self.previous.ids if current.get(record_id) is None]
+
+
+# Storage of the fingerprints per stream and parent id, kept in memory during the sync and
+# saved at its end by save(): in the state (key 'fingerprints'), so they are only kept once
+# the target has processed the records, or in a sidecar file. They are not in the STATE
+# messages during the sync (they are large, ~1 MB for 100000 records).
+class FingerprintStore:
+    def __init__(self):
+        self.streams = set()
+        self.tombstones = False
+        self.path = None
+        self.__fingerprints = {}
+        self.__lock = threading.Lock()
+
+    # streams: streams with change detection, path: sidecar file (None = in the state).
+    # The fingerprints in the state are removed from it until save(state).
+    def configure(self, state, streams=None, tombstones=False, path=None):
+        self.streams = set(streams or [])
+        self.tombstones = tombstones
+        self.path = path
+        self.__fingerprints = state.pop('fingerprints', None) or {}
+        if path:
+            self.__fingerprints = {}
+            if os.path.exists(path):
+                with open(path) as file:
+                    self.__fingerprints = json.load(file)
+
+    def enabled(self, stream_name):
+        return stream_name in self.streams
+
+    def get(self, stream_name, parent_id=None):
+        with self.__lock:
+            value = self.__fingerprints.get(stream_name, {}).get(str(parent_id or ''))
+        return Fingerprints.decode(value)
+
+    def set(self, stream_name, parent_id, fingerprints):
+        value = fingerprints.encode()
+        with self.__lock:
+            self.__fingerprints.setdefault(stream_name, {})[str(parent_id or '')] = value
+
+    # Returns True if the fingerprints were added to the state (the caller writes the state)
+    def save(self, state):
+        if not self.path:
+            if not self.__fingerprints:
+                return False
+            with self.__lock:
+                state['fingerprints'] = self.__fingerprints
+            return True
+        with self.__lock:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            file_descriptor, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(file_descriptor, 'w') as file:
+                json.dump(self.__fingerprints, file)
+            os.replace(tmp_path, self.path)
+        LOGGER.info('Fingerprints written to: {}'.format(self.path))
+        return False
@@ -1,12 +1,30 @@
+import json
+import threading
 import time
-import backoff
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError
 
 import singer
 from singer import metrics
 
+from tap_awin_advertiser.cache import NO_CACHE
+from tap_awin_advertiser.json_stream import iter_json_array
+from tap_awin_advertiser.profiling import PROFILER, RATE_LIMIT, HTTP, CACHE, JSON_DECODE
+from tap_awin_advertiser.rate_limiter import (
+    RateLimiter, DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_RETRY_AFTER, parse_retry_after)
+from tap_awin_advertiser.retry import RetryPolicy
+
 API_URL = 'https://api.awin.com'
+STREAM_CHUNK_SIZE = 65536
+
+# Connections kept alive per host (requests' default); should be at least the number of
+# concurrent requests, otherwise connections are closed and opened again
+DEFAULT_POOL_SIZE = 10
+ACCEPT_ENCODING = 'gzip, deflate'
+
+# Maximum number of requests in flight of the AsyncAwinClient (async_client.py)
+DEFAULT_ASYNC_CONCURRENCY = 10
 LOGGER = singer.get_logger()
 
 
@@ -14,8 +32,11 @@ class Server5xxError(Exception):
     pass
 
 
+# retry_after: seconds to wait before the request is retried
 class Server429Error(Exception):
-    pass
+    def __init__(self, retry_after=None):
+        super().__init__()
+        self.retry_after = retry_after
 
 
 class AwinError(Exception):
@@ -26,6 +47,10 @@ class AwinNotFoundError(AwinError):
     pass
 
 
+# Errors after which a request is retried
+RETRY_EXCEPTIONS = (Server5xxError, ConnectionError, Server429Error)
+
+
 ERROR_CODE_EXCEPTION_MAPPING = {
     404: AwinNotFoundError}
 
@@ -42,60 +67,158 @@ def raise_for_error(response):
     try:
         response.raise_for_status()
     except (requests.HTTPError, requests.ConnectionError) as error:
-        try:
-            content_length = len(response.content)
-            if content_length == 0:
-                # There is nothing we can do here since Snapchat has neither sent
-                # us a 2xx response nor a response content.
-                return
-            #if status_code in [404]:
-            #        LOGGER.error(response)
-
-            response_json = response.json()
-            status_code = response.status_code
-            error_type = response_json.get('error')
-            error_description = response_json.get('description')
-
-            if error_type:
-                error_message = '{} {}: {}'.format(status_code, error_type, error_description)
-                LOGGER.error(error_message)
-                ex = get_exception_for_error_code(status_code)
-                raise ex(error_message)
-            else:
-                raise AwinError(error)
-        except (ValueError, TypeError):
+        raise_for_error_content(response.status_code, response.content, error)
+        # An error without a body is not returned (and cached) as a response
+        raise AwinError(error)
+
+# Raise the exception for an error response (status code and body), used by both clients
+def raise_for_error_content(status_code, content, error):
+    try:
+        content_length = len(content)
+        if content_length == 0:
+            # There is nothing we can do here since Snapchat has neither sent
+            # us a 2xx response nor a response content.
+            return
+        #if status_code in [404]:
+        #        LOGGER.error(response)
+
+        response_json = json.loads(content)
+        error_type = response_json.get('error')
+        error_description = response_json.get('description')
+
+        if error_type:
+            error_message = '{} {}: {}'.format(status_code, error_type, error_description)
+            LOGGER.error(error_message)
+            ex = get_exception_for_error_code(status_code)
+            raise ex(error_message)
+        else:
             raise AwinError(error)
+    except (ValueError, TypeError):
+        raise AwinError(error)
+
+# Catch invalid json response
+def parse_json(response):
+    try:
+        response_json = response.json()
+    except Exception as err:
+        LOGGER.error('{}'.format(err))
+        LOGGER.error('response.headers = {}'.format(response.headers))
+        LOGGER.error('response.reason = {}'.format(response.reason))
+        raise Exception(err)
+
+    return response_json
 
 class AwinClient:
     def __init__(self,
                  oauth2_token,
-                 user_agent=None):
+                 user_agent=None,
+                 requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 rate_limit_burst=1,
+                 cache=None,
+                 base_url=API_URL,
+                 pool_size=DEFAULT_POOL_SIZE,
+                 keep_alive=True,
+                 retry_policy=None):
         self.__oauth2_token = oauth2_token
         self.__user_agent = user_agent
         self.__session = requests.Session()
-        self.base_url = API_URL
+        # Compressed responses are decoded by urllib3
+        self.__session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+        if not keep_alive:
+            self.__session.headers['Connection'] = 'close'
+        # Retries are done by request() (retry_policy), not by the adapter
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.__session.mount('https://', adapter)
+        self.__session.mount('http://', adapter)
+        # endpoint: [bytes received (compressed), bytes decompressed]
+        self.__transfer = {}
+        self.__transfer_lock = threading.Lock()
+        # requests_per_minute = 0 disables client side rate limiting
+        self.__rate_limiter = None
+        if requests_per_minute:
+            self.__rate_limiter = RateLimiter(requests_per_minute, rate_limit_burst)
+        # Optional ResponseCache for GET requests with a cache_ttl
+        self.__cache = cache
+        # Retries, retry budget and circuit breakers (retry.py), may be shared by clients
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.base_url = base_url.rstrip('/')
 
     def __enter__(self):
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
         self.__session.close()
-
-    @backoff.on_exception(backoff.expo,
-                          (Server5xxError, ConnectionError, Server429Error),
-                          max_tries=7,
-                          factor=3)
+        if self.__rate_limiter:
+            self.__rate_limiter.log_metrics()
+        if self.__cache:
+            self.__cache.log_metrics()
+        self.log_transfer_metrics()
+
+    # Count the bytes of a response body: received (as sent by the server, e.g. gzip
+    # compressed) and decompressed
+    def __count_bytes(self, endpoint, response, decompressed_bytes):
+        try:
+            received_bytes = response.raw.tell()
+        except AttributeError:
+            received_bytes = decompressed_bytes
+        with self.__transfer_lock:
+            transfer = self.__transfer.setdefault(endpoint, [0, 0])
+            transfer[0] += received_bytes
+            transfer[1] += decompressed_bytes
+
+    def __count_chunks(self, endpoint, response, chunks):
+        decompressed_bytes = 0
+        for chunk in chunks:
+            decompressed_bytes += len(chunk)
+            yield chunk
+        self.__count_bytes(endpoint, response, decompressed_bytes)
+
+    def log_transfer_metrics(self):
+        with self.__transfer_lock:
+            transfer = dict(self.__transfer)
+        for endpoint, (received_bytes, decompressed_bytes) in transfer.items():
+            tags = {metrics.Tag.endpoint: endpoint}
+            metrics.log(LOGGER, metrics.Point(
+                'counter', 'http_response_bytes', received_bytes, tags))
+            metrics.log(LOGGER, metrics.Point(
+                'counter', 'http_response_decompressed_bytes', decompressed_bytes, tags))
+
+    # Send the request, retried after RETRY_EXCEPTIONS as the retry_policy allows.
+    # Raises CircuitOpenError without a request if the circuit breaker of the endpoint is open.
+    # kwargs response_info: optional dict, gets 'server_seconds': seconds from sending the
+    #   successful request until its response headers (without rate limit waits and retries)
     def request(self, method, path=None, url=None, **kwargs):
 
         if not url and path:
             url = '{}/{}'.format(self.base_url, path)
 
         # endpoint = stream_name (from sync.py API call)
-        if 'endpoint' in kwargs:
-            endpoint = kwargs['endpoint']
-            del kwargs['endpoint']
-        else:
-            endpoint = None
+        endpoint = kwargs.pop('endpoint', None)
+        response_info = kwargs.pop('response_info', None)
+
+        self.retry_policy.check(endpoint)
+        tries = 0
+        while True:
+            tries += 1
+            try:
+                response = self.__request(method, url, endpoint, response_info, **kwargs)
+            except Exception as err:
+                wait = None
+                if isinstance(err, RETRY_EXCEPTIONS):
+                    wait = self.retry_policy.retry_delay(endpoint, tries, err)
+                if wait is None:
+                    # Server errors and connection errors count as failures of the endpoint
+                    self.retry_policy.record(
+                        endpoint, isinstance(err, (Server5xxError, ConnectionError)))
+                    raise
+                LOGGER.info('Backing off request(...) for {:.1f}s ({})'.format(
+                    wait, type(err).__name__))
+                time.sleep(wait)
+                continue
+            self.retry_policy.record(endpoint, False)
+            return response
+
+    def __request(self, method, url, endpoint, response_info, **kwargs):
 
         if 'headers' not in kwargs:
             kwargs['headers'] = {}
@@ -104,7 +227,11 @@ class AwinClient:
         if self.__user_agent:
             kwargs['headers']['User-Agent'] = self.__user_agent
 
-        with metrics.http_request_timer(endpoint) as timer:
+        if self.__rate_limiter:
+            with PROFILER.stage(endpoint, RATE_LIMIT):
+                self.__rate_limiter.acquire(endpoint)
+
+        with metrics.http_request_timer(endpoint) as timer, PROFILER.stage(endpoint, HTTP):
             response = self.__session.request(method, url, **kwargs)
             timer.tags[metrics.Tag.http_status_code] = response.status_code
 
@@ -112,6 +239,7 @@ class AwinClient:
             raise Server5xxError()
 
         if response.status_code == 429:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
             try:
                 response_json = response.json()
                 error_type = response_json.get('error')
@@ -120,28 +248,96 @@ class AwinClient:
                 if error_type == 'request.limit.exceeded':
                     # the request limit is set for one minute, sample error message:
                     #   Requests limit '20' times per '1' minutes' is exceeded
-                    # so we just wait 1 minute and try again
                     LOGGER.warning('Request limit exceeded: {}'.format(error_description))
-                    time.sleep(60)
             except Exception as err:
                 pass
 
-            raise Server429Error()
+            # Without a Retry-After header we just wait 1 minute and try again.
+            # The pause applies to all requests of this client, not only this one.
+            if retry_after is None:
+                retry_after = DEFAULT_RETRY_AFTER
+            if self.__rate_limiter:
+                self.__rate_limiter.pause(retry_after)
+
+            raise Server429Error(retry_after)
 
+        if self.__rate_limiter:
+            self.__rate_limiter.update_from_headers(response.headers)
+
+        # Error responses are mapped to exceptions also for streamed requests
+        # (their body is read here)
         if response.status_code != 200:
             LOGGER.error('{}: {}'.format(response.status_code, response.text))
             raise_for_error(response)
 
-        # Catch invalid json response
-        try:
-            response_json = response.json()
-        except Exception as err:
-            LOGGER.error('{}'.format(err))
-            LOGGER.error('response.headers = {}'.format(response.headers))
-            LOGGER.error('response.reason = {}'.format(response.reason))
-            raise Exception(err)
+        if response_info is not None:
+            response_info['server_seconds'] = response.elapsed.total_seconds()
 
-        return response_json
+        # The body of a streamed response is read by the caller
+        if kwargs.get('stream'):
+            return response
+
+        self.__count_bytes(endpoint, response, len(response.content))
+        with PROFILER.stage(endpoint, JSON_DECODE):
+            return parse_json(response)
 
+    # kwargs cache_ttl: seconds the response may be served from the cache (if the client has one);
+    #   CACHE_FOREVER for responses that do not change anymore, NO_CACHE (default) to not cache
     def get(self, url, **kwargs):
-        return self.request('GET', url=url, *kwargs)
+        endpoint = kwargs.get('endpoint')
+        cache_path, cache_ttl = self.__cache_lookup(url, kwargs)
+        if cache_path:
+            with PROFILER.stage(endpoint, CACHE):
+                body = self.__cache.read(cache_path)
+            with PROFILER.stage(endpoint, JSON_DECODE):
+                return json.loads(body)
+        if cache_ttl == NO_CACHE:
+            return self.request('GET', url=url, **kwargs)
+
+        response = self.request('GET', url=url, stream=True, **kwargs)
+        with PROFILER.stage(endpoint, HTTP):
+            body = response.content
+        self.__count_bytes(endpoint, response, len(body))
+        with PROFILER.stage(endpoint, JSON_DECODE):
+            response_json = parse_json(response)
+        # Only successful responses are cached (e.g. not an error without a body)
+        if response.status_code == 200:
+            with PROFILER.stage(endpoint, CACHE):
+                self.__cache.write(url, body, kwargs.get('params'))
+        return response_json
+
+    # Send the request and return an iterator over the records of the JSON array response.
+    # The body is decoded incrementally while iterating, it is never loaded as a whole.
+    def get_records(self, url, **kwargs):
+        endpoint = kwargs.get('endpoint')
+        cache_path, cache_ttl = self.__cache_lookup(url, kwargs)
+        if cache_path:
+            chunks = PROFILER.iterate(endpoint, CACHE, self.__cache.read_chunks(cache_path))
+            return PROFILER.iterate(endpoint, JSON_DECODE, iter_json_array(chunks))
+
+        response = self.request('GET', url=url, stream=True, **kwargs)
+        chunks = PROFILER.iterate(endpoint, HTTP, self.__count_chunks(
+            endpoint, response, response.iter_content(chunk_size=STREAM_CHUNK_SIZE)))
+        if cache_ttl != NO_CACHE and response.status_code == 200:
+            chunks = PROFILER.iterate(
+                endpoint, CACHE, self.__cache.tee(url, chunks, kwargs.get('params')))
+        return PROFILER.iterate(endpoint, JSON_DECODE, self.__iter_records(response, chunks))
+
+    # Returns the path of a cached response (or None) and the cache_ttl of the request
+    def __cache_lookup(self, url, kwargs):
+        cache_ttl = kwargs.pop('cache_ttl', NO_CACHE)
+        if self.__cache is None:
+            return None, NO_CACHE
+        # In replay mode all requests are served from the cache
+        if cache_ttl == NO_CACHE and not self.__cache.replay:
+            return None, NO_CACHE
+        cache_path = self.__cache.lookup(
+            url, kwargs.get('params'), cache_ttl, kwargs.get('endpoint'))
+        return cache_path, cache_ttl
+
+    @staticmethod
+    def __iter_records(response, chunks):
+        try:
+            yield from iter_json_array(chunks, encoding=response.encoding or 'utf-8')
+        finally:
+            response.close()
@@ -0,0 +1,240 @@
+import json
+import os
+import threading
+import time
+
+import singer
+
+from tap_awin_advertiser.transform import parse_datetime
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+LOGGER = singer.get_logger()
+
+FORMATS = ('parquet', 'arrow')
+DEFAULT_COMPRESSION = 'zstd'
+# Records buffered per stream before they are written to files
+DEFAULT_FILE_RECORDS = 100000
+# Every STATE message flushes the buffered records (one file per stream and partition),
+# so the state is written at most every file_records records or this many seconds by default
+DEFAULT_STATE_CHECKPOINT_SECONDS = 300
+# Records are partitioned by this field (if it is in the schema) and by the date of the
+# replication key of the stream
+PARTITION_FIELD = 'advertiser_id'
+# Partition value of records without a value
+DEFAULT_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+def convert_datetime(value):
+    if value is None:
+        return None
+    return parse_datetime(value)
+
+
+def convert_json(value):
+    if value is None:
+        return None
+    return json.dumps(value)
+
+
+# Arrow type of a JSON schema and a function converting the (transformed) values to
+# Arrow values, or None if the values are used as they are:
+#   integer, number, boolean, string: int64, float64, bool, string
+#   string with format date-time: timestamp (UTC)
+#   object with properties: struct; array: list
+#   anything else (e.g. objects without properties, several types): JSON string
+def compile_column(schema):
+    types = schema.get('type', [])
+    if not isinstance(types, list):
+        types = [types]
+    types = [typ for typ in types if typ != 'null']
+    typ = types[0] if len(types) == 1 else None
+
+    if typ == 'string' and schema.get('format') == 'date-time':
+        return pyarrow.timestamp('us', tz='UTC'), convert_datetime
+    if typ == 'object' and schema.get('properties'):
+        fields = [
+            (key, compile_column(sub_schema))
+            for key, sub_schema in schema['properties'].items()]
+        arrow_type = pyarrow.struct([
+            pyarrow.field(key, field_type) for key, (field_type, _) in fields])
+        converters = [(key, convert) for key, (_, convert) in fields if convert]
+        if not converters:
+            return arrow_type, None
+
+        def convert_object(value):
+            if value is None:
+                return None
+            value = dict(value)
+            for key, convert in converters:
+                if key in value:
+                    value[key] = convert(value[key])
+            return value
+
+        return arrow_type, convert_object
+    if typ == 'array' and 'items' in schema:
+        item_type, convert_item = compile_column(schema['items'])
+        if not convert_item:
+            return pyarrow.list_(item_type), None
+
+        def convert_array(value):
+            if value is None:
+                return None
+            return [convert_item(item) for item in value]
+
+        return pyarrow.list_(item_type), convert_array
+
+    scalar_type = {
+        'string': pyarrow.string(),
+        'integer': pyarrow.int64(),
+        'number': pyarrow.float64(),
+        'boolean': pyarrow.bool_()
+    }.get(typ)
+    if scalar_type is not None:
+        return scalar_type, None
+    return pyarrow.string(), convert_json
+
+
+# Columns of a stream: the Arrow schema and (field, converter) per column.
+# The partition field is not stored in the files (it is in the path, as usual for Hive
+# style partitions).
+# The table of a batch of records is built by pyarrow (Table.from_pylist) with the top level
+# date-time columns as strings, which are then cast to timestamps. Only the other columns
+# with converters (nested date-times, JSON strings) are converted in Python.
+class StreamColumns:
+    def __init__(self, schema, date_field=None):
+        properties = schema.get('properties') or {}
+        self.partition_field = PARTITION_FIELD if PARTITION_FIELD in properties else None
+        self.date_field = date_field
+        columns = [
+            (key, compile_column(sub_schema))
+            for key, sub_schema in properties.items() if key != self.partition_field]
+        self.arrow_schema = pyarrow.schema([
+            pyarrow.field(key, arrow_type) for key, (arrow_type, _) in columns])
+        # (index, field, converter) of the columns converted in Python
+        self.converted_columns = [
+            (index, self.arrow_schema.field(index), convert)
+            for index, (_, (_, convert)) in enumerate(columns)
+            if convert and convert is not convert_datetime]
+        converted = set(field.name for _, field, _ in self.converted_columns)
+        self.input_schema = pyarrow.schema([
+            pyarrow.field(field.name, pyarrow.string()) \
+                if convert is convert_datetime else field
+            for field, (_, (_, convert)) in zip(self.arrow_schema, columns)
+            if field.name not in converted])
+
+    # Partition of a record: (advertiser_id, date)
+    def partition(self, record):
+        advertiser_id = None
+        if self.partition_field:
+            advertiser_id = record.get(self.partition_field)
+        date = None
+        if self.date_field:
+            value = record.get(self.date_field)
+            date = value[:10] if value else None
+        return advertiser_id, date
+
+    def table(self, records):
+        table = pyarrow.Table.from_pylist(records, schema=self.input_schema)
+        for index, field, convert in self.converted_columns:
+            table = table.add_column(index, field, pyarrow.array(
+                [convert(record.get(field.name)) for record in records], type=field.type))
+        return table.cast(self.arrow_schema)
+
+
+# Writes the transformed records to Parquet or Arrow (IPC) files instead of stdout.
+# The records are buffered per stream and partition and written to
+#   <output_dir>/<stream>/advertiser_id=<id>/date=<yyyy-mm-dd>/part-<run>-<number>.<format>
+# (Hive style partitions, the levels of fields which are not in the stream are left out)
+# when a stream buffered file_records records and on flush(), which the SingerWriter calls
+# before every STATE message. So the files of all records of a state are complete before
+# the state is emitted. Files are written to a temporary name and renamed when complete.
+# Records synced again by a later run (e.g. the attribution window) are written to new files
+# in the same partitions, the latest run's part files (by name) have the current rows.
+# The writer is thread-safe.
+class ColumnarWriter:
+    def __init__(self,
+                 output_dir,
+                 file_format='parquet',
+                 compression=DEFAULT_COMPRESSION,
+                 file_records=DEFAULT_FILE_RECORDS,
+                 date_fields=None):
+        if pyarrow is None:
+            raise ValueError('Output format {} requires pyarrow ' \
+                '(pip install tap-awin-advertiser[parquet])'.format(file_format))
+        if file_format not in FORMATS:
+            raise ValueError('Invalid output format: {}'.format(file_format))
+        if not output_dir:
+            raise ValueError('Output format {} requires an output_dir'.format(file_format))
+        self.output_dir = output_dir
+        self.file_format = file_format
+        self.compression = compression
+        self.file_records = max(1, int(file_records))
+        # stream: replication key, the date of the partition
+        self.date_fields = date_fields or {}
+        self.__lock = threading.RLock()
+        self.__streams = {}
+        # stream: {partition: [records]}
+        self.__buffers = {}
+        self.__buffered = {}
+        self.__run = '{}-{}'.format(time.strftime('%Y%m%dT%H%M%S'), os.getpid())
+        self.__files = 0
+
+    def add_stream(self, stream_name, schema):
+        with self.__lock:
+            if stream_name not in self.__streams:
+                self.__streams[stream_name] = StreamColumns(
+                    schema, self.date_fields.get(stream_name))
+
+    def write_record(self, stream_name, record):
+        with self.__lock:
+            columns = self.__streams[stream_name]
+            partitions = self.__buffers.setdefault(stream_name, {})
+            partitions.setdefault(columns.partition(record), []).append(record)
+            self.__buffered[stream_name] = self.__buffered.get(stream_name, 0) + 1
+            if self.__buffered[stream_name] >= self.file_records:
+                self.flush_stream(stream_name)
+
+    def flush_stream(self, stream_name):
+        with self.__lock:
+            columns = self.__streams[stream_name]
+            partitions = self.__buffers.pop(stream_name, {})
+            for partition, records in partitions.items():
+                self.__write_file(stream_name, columns, partition, records)
+            LOGGER.info('Stream: {}, wrote {} records to {} {} files'.format(
+                stream_name, self.__buffered[stream_name], len(partitions), self.file_format))
+            self.__buffered[stream_name] = 0
+
+    def flush(self):
+        with self.__lock:
+            for stream_name in list(self.__buffers):
+                self.flush_stream(stream_name)
+
+    def __write_file(self, stream_name, columns, partition, records):
+        advertiser_id, date = partition
+        path = os.path.join(self.output_dir, stream_name)
+        if columns.partition_field:
+            path = os.path.join(path, '{}={}'.format(
+                columns.partition_field, DEFAULT_PARTITION if advertiser_id is None \
+                    else advertiser_id))
+        if columns.date_field:
+            path = os.path.join(path, 'date={}'.format(date or DEFAULT_PARTITION))
+        os.makedirs(path, exist_ok=True)
+        self.__files += 1
+        file_path = os.path.join(path, 'part-{}-{:05d}.{}'.format(
+            self.__run, self.__files, self.file_format))
+
+        table = columns.table(records)
+        temp_path = file_path + '.tmp'
+        if self.file_format == 'parquet':
+            pyarrow.parquet.write_table(table, temp_path, compression=self.compression)
+        else:
+            options = pyarrow.ipc.IpcWriteOptions(compression=self.compression)
+            with pyarrow.ipc.new_file(temp_path, table.schema, options=options) as writer:
+                writer.write_table(table)
+        os.replace(temp_path, file_path)
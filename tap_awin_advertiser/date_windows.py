@@ -0,0 +1,45 @@
+import singer
+
+LOGGER = singer.get_logger()
+
+DEFAULT_TARGET_RECORDS = 5000
+DEFAULT_MAX_SECONDS = 60
+
+
+# Date window size (days) of one parent (account), adapted to the responses:
+# the window is doubled while responses are small and fast, and halved when a response
+# has more than twice the target number of records or takes longer than max_seconds.
+# The size stays between min_days and max_days (the maximum date range of the API).
+class AdaptiveDateWindow:
+    def __init__(self,
+                 days,
+                 min_days=1,
+                 max_days=None,
+                 target_records=DEFAULT_TARGET_RECORDS,
+                 max_seconds=DEFAULT_MAX_SECONDS):
+        self.min_days = min_days
+        self.max_days = max_days
+        self.target_records = target_records
+        self.max_seconds = max_seconds
+        self.days = self.__limit(days)
+
+    def __limit(self, days):
+        days = max(self.min_days, int(days))
+        if self.max_days:
+            days = min(self.max_days, days)
+        return days
+
+    # Adapt the size to the last response; returns True if the size changed
+    def update(self, record_count, seconds):
+        days = self.days
+        if record_count > 2 * self.target_records or seconds > self.max_seconds:
+            days = self.__limit(days // 2)
+        elif record_count < self.target_records / 2 and seconds < self.max_seconds / 2:
+            days = self.__limit(days * 2)
+
+        if days == self.days:
+            return False
+        LOGGER.info('Date window size changed from {} to {} days ({} records, {:.1f} s)'.format(
+            self.days, days, record_count, seconds))
+        self.days = days
+        return True
@@ -0,0 +1,98 @@
+import bisect
+import hashlib
+import threading
+from array import array
+
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+# Ids added since the last merge are kept in a set until they are this share of the sorted
+# ids (1 / PENDING_RATIO), but at least MIN_PENDING
+PENDING_RATIO = 16
+MIN_PENDING = 65536
+
+
+# 64 bit integer of a record id: integers as they are, other ids (e.g. strings) hashed
+def id_key(record_id):
+    if isinstance(record_id, int) and INT64_MIN <= record_id <= INT64_MAX:
+        return record_id
+    digest = hashlib.blake2b(str(record_id).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+# Ids of the records of one parent seen in this run: a sorted array of 64 bit integers
+# (8 bytes per id, instead of ~70 bytes per id of a set) and a set of the ids added since
+# the last merge. Ids above the largest sorted id (ascending ids, the usual case) are not
+# searched in the array and are appended by the merge; other ids are merged by copying
+# the slices of the array between them.
+# Not thread-safe, the records of a parent are processed by one thread at a time.
+class IdSet:
+    def __init__(self):
+        self.ids = array('q')
+        self.pending = set()
+        # Number of pending ids that triggers a merge
+        self.merge_size = MIN_PENDING
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self.ids) + len(self.pending)
+
+    # Returns False (and counts a duplicate) if the id was added before.
+    # Records without an id are never duplicates.
+    def add(self, record_id):
+        if record_id is None:
+            return True
+        key = id_key(record_id)
+        ids = self.ids
+        if key in self.pending or \
+                (ids and key <= ids[-1] and ids[bisect.bisect_left(ids, key)] == key):
+            self.duplicates += 1
+            return False
+        self.pending.add(key)
+        if len(self.pending) >= self.merge_size:
+            self.merge()
+        return True
+
+    def merge(self):
+        if not self.pending:
+            return
+        pending = sorted(self.pending)
+        self.pending = set()
+        self.merge_size = max(MIN_PENDING, (len(self.ids) + len(pending)) // PENDING_RATIO)
+        ids = self.ids
+        if not ids or pending[0] > ids[-1]:
+            ids.extend(pending)
+            return
+        merged = array('q')
+        start = 0
+        for key in pending:
+            end = bisect.bisect_left(ids, key, start)
+            merged.extend(ids[start:end])
+            merged.append(key)
+            start = end
+        merged.extend(ids[start:])
+        self.ids = merged
+
+
+# Ids of the records written by this run per stream and parent id, for the streams
+# with deduplication. Kept for the whole run, so records are also skipped when they are
+# returned again by another date window, the validation pass (validation_delta) or the
+# sync of a deferred account.
+class Deduplicator:
+    def __init__(self):
+        self.streams = set()
+        self.__id_sets = {}
+        self.__lock = threading.Lock()
+
+    def configure(self, streams=None):
+        self.streams = set(streams or [])
+        self.__id_sets = {}
+
+    def enabled(self, stream_name):
+        return stream_name in self.streams
+
+    def get(self, stream_name, parent_id=None):
+        with self.__lock:
+            id_set = self.__id_sets.get((stream_name, parent_id))
+            if id_set is None:
+                id_set = self.__id_sets[(stream_name, parent_id)] = IdSet()
+        return id_set
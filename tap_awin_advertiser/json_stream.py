@@ -0,0 +1,98 @@
+import codecs
+import json
+
+WHITESPACE = ' \t\n\r'
+DELIMITERS = WHITESPACE + ',]'
+
+# Compact the buffer when this many characters were consumed
+COMPACT_SIZE = 65536
+
+
+# Incrementally decode a top-level JSON array from an iterable of byte chunks
+# (e.g. response.iter_content()) and yield its elements one by one.
+# Only the current element and the unconsumed rest of the last chunk are kept in memory.
+# A body that is not an array is decoded as a whole; an empty object or null yields nothing.
+def iter_json_array(chunks, encoding='utf-8'):
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder(encoding)()
+    chunks = iter(chunks)
+    buffer = ''
+    pos = 0
+    finished = False
+
+    def read():
+        nonlocal buffer, pos, finished
+        if pos >= COMPACT_SIZE:
+            buffer = buffer[pos:]
+            pos = 0
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            buffer += text_decoder.decode(b'', final=True)
+            finished = True
+            return
+        buffer += text_decoder.decode(chunk)
+
+    # Move pos to the next non whitespace character; False at the end of the body
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in WHITESPACE:
+                pos += 1
+            if pos < len(buffer):
+                return True
+            if finished:
+                return False
+            read()
+
+    # Read the rest of the body after the array, only whitespace may follow
+    def finish():
+        nonlocal pos
+        pos += 1
+        if skip_whitespace():
+            raise ValueError('Extra data after JSON array at position {}'.format(pos))
+
+    if not skip_whitespace():
+        return
+
+    if buffer[pos] != '[':
+        while not finished:
+            read()
+        data = json.loads(buffer[pos:])
+        if not data:
+            return
+        raise ValueError('Expected a JSON array, got: {}'.format(type(data).__name__))
+
+    pos += 1
+    if not skip_whitespace():
+        raise ValueError('Unexpected end of JSON array')
+    if buffer[pos] == ']':
+        finish()
+        return
+
+    while True:
+        # Decode the next element, reading more data until it is complete.
+        # A value that is not followed by a delimiter (e.g. the number 1 of 1.5e3) may
+        # continue in the next chunk.
+        while True:
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+                if finished or (end < len(buffer) and buffer[end] in DELIMITERS):
+                    break
+            except json.JSONDecodeError:
+                if finished:
+                    raise
+            read()
+        pos = end
+        yield element
+
+        if not skip_whitespace():
+            raise ValueError('Unexpected end of JSON array')
+        if buffer[pos] == ']':
+            finish()
+            return
+        if buffer[pos] != ',':
+            raise ValueError('Expected , or ] at position {} of JSON array'.format(pos))
+        pos += 1
+        if not skip_whitespace():
+            raise ValueError('Unexpected end of JSON array')
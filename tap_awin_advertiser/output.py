@@ -0,0 +1,186 @@
+import sys
+import threading
+import time
+
+import pytz
+import simplejson
+import singer
+from singer import utils
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+LOGGER = singer.get_logger()
+
+# Records are written to stdout in batches of this many records (or bytes)
+DEFAULT_BATCH_SIZE = 1000
+MAX_BUFFER_BYTES = 1024 * 1024
+
+
+# Encode a message like singer.messages.format_message
+def encode_message(message_dict, fast_json=False):
+    if fast_json and orjson is not None:
+        try:
+            return orjson.dumps(message_dict)
+        except TypeError:
+            # e.g. Decimal values, which orjson does not serialize
+            pass
+    return simplejson.dumps(message_dict, use_decimal=True).encode('utf-8')
+
+
+# Buffered writer for the Singer messages of the tap.
+# RECORD messages are encoded (with orjson, if installed and fast_json is set) and collected
+# in a buffer, which is written to stdout in batches. The buffer is always written before any
+# other message (SCHEMA, STATE), so a STATE message never overtakes the records it covers.
+# STATE messages can be coalesced: with a checkpoint interval (records and/or seconds) only
+# the latest state is kept and written once the interval is reached, or when it is flushed.
+# With a record sink (e.g. a columnar.ColumnarWriter) the records are passed to the sink
+# instead of stdout; the sink is flushed before every STATE message.
+# The writer is thread-safe.
+class SingerWriter:
+    def __init__(self,
+                 output=None,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 fast_json=True,
+                 state_checkpoint_records=0,
+                 state_checkpoint_seconds=0,
+                 record_sink=None):
+        # output: binary file object; default = stdout
+        self.__output = output
+        self.__batch_size = max(1, int(batch_size))
+        self.__fast_json = fast_json
+        self.__buffer = []
+        self.__buffer_bytes = 0
+        self.__lock = threading.RLock()
+        # time_extracted is the same for all records of a response, it is formatted once
+        self.__time_extracted = None
+        self.__time_extracted_str = None
+        # 0 = no checkpoint interval, every state is written
+        self.__state_checkpoint_records = int(state_checkpoint_records)
+        self.__state_checkpoint_seconds = float(state_checkpoint_seconds)
+        self.__pending_state = None
+        self.__records_since_state = 0
+        self.__last_state_time = time.monotonic()
+        self.__record_sink = record_sink
+
+    # record_sink: replaces the current sink (False: no sink)
+    def configure(self,
+                  batch_size=None,
+                  fast_json=None,
+                  state_checkpoint_records=None,
+                  state_checkpoint_seconds=None,
+                  record_sink=None):
+        with self.__lock:
+            self.flush_state()
+            self.flush()
+            if record_sink is not None:
+                if self.__record_sink:
+                    self.__record_sink.flush()
+                self.__record_sink = record_sink or None
+            if batch_size is not None:
+                self.__batch_size = max(1, int(batch_size))
+            if fast_json is not None:
+                self.__fast_json = fast_json
+            if state_checkpoint_records is not None:
+                self.__state_checkpoint_records = int(state_checkpoint_records)
+            if state_checkpoint_seconds is not None:
+                self.__state_checkpoint_seconds = float(state_checkpoint_seconds)
+            if self.__fast_json and orjson is None:
+                LOGGER.info('orjson is not installed, records are encoded with simplejson')
+
+    def write_record(self, stream_name, record, time_extracted=None):
+        message = {
+            'type': 'RECORD',
+            'stream': stream_name,
+            'record': record,
+        }
+        with self.__lock:
+            if self.__record_sink:
+                self.__records_since_state += 1
+                self.__record_sink.write_record(stream_name, record)
+                return
+
+            if time_extracted:
+                if time_extracted is not self.__time_extracted:
+                    self.__time_extracted = time_extracted
+                    self.__time_extracted_str = utils.strftime(
+                        time_extracted.astimezone(pytz.utc))
+                message['time_extracted'] = self.__time_extracted_str
+
+            line = encode_message(message, self.__fast_json) + b'\n'
+            self.__records_since_state += 1
+            self.__buffer.append(line)
+            self.__buffer_bytes += len(line)
+            if len(self.__buffer) >= self.__batch_size or \
+                    self.__buffer_bytes >= MAX_BUFFER_BYTES:
+                self.flush()
+
+    # Write any other message, after the buffered records
+    def write_message(self, message):
+        with self.__lock:
+            self.__buffer.append(encode_message(message.asdict()) + b'\n')
+            self.flush()
+
+    def write_schema(self, stream_name, schema, key_properties, bookmark_properties=None):
+        if self.__record_sink:
+            self.__record_sink.add_stream(stream_name, schema)
+        self.write_message(singer.SchemaMessage(
+            stream=stream_name,
+            schema=schema,
+            key_properties=key_properties,
+            bookmark_properties=bookmark_properties))
+
+    # The state is written if force is set or the checkpoint interval is reached,
+    # otherwise it is kept (by reference) until the next checkpoint or flush_state()
+    def write_state(self, value, force=False):
+        with self.__lock:
+            self.__pending_state = value
+            if force or self.__state_checkpoint_reached():
+                self.flush_state()
+
+    def __state_checkpoint_reached(self):
+        if not self.__state_checkpoint_records and not self.__state_checkpoint_seconds:
+            return True
+        if self.__state_checkpoint_records and \
+                self.__records_since_state >= self.__state_checkpoint_records:
+            return True
+        if self.__state_checkpoint_seconds and \
+                time.monotonic() - self.__last_state_time >= self.__state_checkpoint_seconds:
+            return True
+        return False
+
+    # Write the pending state, if any
+    def flush_state(self):
+        with self.__lock:
+            if self.__pending_state is None:
+                return
+            # The records of the state are written first
+            if self.__record_sink:
+                self.__record_sink.flush()
+            # The state is serialized while holding the lock
+            self.write_message(singer.StateMessage(value=self.__pending_state))
+            self.__pending_state = None
+            self.__records_since_state = 0
+            self.__last_state_time = time.monotonic()
+
+    # Write the records buffered by the record sink
+    def flush_records(self):
+        with self.__lock:
+            if self.__record_sink:
+                self.__record_sink.flush()
+
+    def flush(self):
+        with self.__lock:
+            if not self.__buffer:
+                return
+            output = self.__output
+            if output is None:
+                # Text written to stdout by others has to come first
+                sys.stdout.flush()
+                output = sys.stdout.buffer
+            output.write(b''.join(self.__buffer))
+            output.flush()
+            self.__buffer = []
+            self.__buffer_bytes = 0
@@ -0,0 +1,148 @@
+import sys
+import threading
+import time
+
+import singer
+from singer import metrics
+
+LOGGER = singer.get_logger()
+
+# Stages of a sync
+RATE_LIMIT = 'rate_limit'
+HTTP = 'http'
+CACHE = 'cache'
+JSON_DECODE = 'json_decode'
+DECAMELIZE = 'decamelize'
+TRANSFORM = 'transform'
+BOOKMARK = 'bookmark'
+WRITE = 'write'
+# Waiting for the prefetched response of the next date window
+PREFETCH_WAIT = 'prefetch_wait'
+
+
+class NoStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        return False
+
+
+NO_STAGE = NoStage()
+
+
+class Stage:
+    __slots__ = ('profiler', 'stream', 'name', 'start', 'blocks', 'child_seconds', 'child_blocks')
+
+    def __init__(self, profiler, stream, name):
+        self.profiler = profiler
+        self.stream = stream
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.stack().append(self)
+        self.child_seconds = 0.0
+        self.child_blocks = 0
+        self.blocks = sys.getallocatedblocks()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        seconds = time.perf_counter() - self.start
+        blocks = sys.getallocatedblocks() - self.blocks
+        stack = self.profiler.stack()
+        stack.pop()
+        # The time of nested stages is only counted for the innermost stage
+        if stack:
+            stack[-1].child_seconds += seconds
+            stack[-1].child_blocks += blocks
+        self.profiler.add(
+            self.stream, self.name, seconds - self.child_seconds, blocks - self.child_blocks)
+        return False
+
+
+# Cumulative time and memory block delta per stream and stage (http, json_decode,
+# decamelize, transform, bookmark, write, prefetch_wait), logged as metrics at the end of
+# the run. Stages may be nested (e.g. reading the HTTP body while decoding a streamed
+# response), the time and block delta of a stage exclude its nested stages.
+# The block delta is the net change of the number of memory blocks allocated by the whole
+# process (sys.getallocatedblocks) during the stage: not a count of allocations (freed
+# blocks are subtracted), and it includes the blocks of all threads. It is only meaningful
+# for serial runs (engine threads, max_workers, window_workers 1, prefetch_windows 0).
+# Optionally the run is profiled with cProfile (main thread only) and the stats are dumped
+# to a file (pstats).
+# When disabled, stage() returns a shared no-op context manager.
+class StageProfiler:
+    def __init__(self):
+        self.enabled = False
+        self.output = None
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        # (stream, stage): [calls, seconds, block delta]
+        self.__totals = {}
+        self.__cprofile = None
+
+    def configure(self, enabled=False, output=None):
+        self.enabled = bool(enabled)
+        self.output = output if enabled else None
+
+    def stack(self):
+        stack = getattr(self.__local, 'stack', None)
+        if stack is None:
+            stack = self.__local.stack = []
+        return stack
+
+    def stage(self, stream, name):
+        if not self.enabled:
+            return NO_STAGE
+        return Stage(self, stream, name)
+
+    # Count the time of each next() of the iterable as stage
+    def iterate(self, stream, name, iterable):
+        if not self.enabled:
+            return iterable
+        return self.__iterate(stream, name, iterable)
+
+    def __iterate(self, stream, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            with self.stage(stream, name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def add(self, stream, name, seconds, blocks=0):
+        with self.__lock:
+            totals = self.__totals.setdefault((stream, name), [0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] += blocks
+
+    def start(self):
+        if self.output:
+            # Only imported if used (startup time)
+            import cProfile
+            self.__cprofile = cProfile.Profile()
+            self.__cprofile.enable()
+
+    def stop(self):
+        if self.__cprofile:
+            self.__cprofile.disable()
+            self.__cprofile.dump_stats(self.output)
+            LOGGER.info('Profile stats written to: {}'.format(self.output))
+            self.__cprofile = None
+        if self.enabled:
+            self.log_metrics()
+
+    def log_metrics(self):
+        with self.__lock:
+            totals = sorted(self.__totals.items(), key=lambda item: (str(item[0][0]), item[0][1]))
+        for (stream, name), (calls, seconds, blocks) in totals:
+            tags = {'stream': stream, 'stage': name, 'calls': calls}
+            metrics.log(LOGGER, metrics.Point('timer', 'stage_time', round(seconds, 6), tags))
+            metrics.log(LOGGER, metrics.Point('counter', 'stage_block_delta', blocks, tags))
+
+
+PROFILER = StageProfiler()
@@ -0,0 +1,114 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import singer
+from singer import metrics
+
+LOGGER = singer.get_logger()
+
+# Awin allows 20 API requests per minute and user:
+#   Requests limit '20' times per '1' minutes' is exceeded
+# Reference: https://wiki.awin.com/index.php/Advertiser_API
+DEFAULT_REQUESTS_PER_MINUTE = 20
+
+# Delay after a 429 response without a Retry-After header
+DEFAULT_RETRY_AFTER = 60
+
+
+def parse_retry_after(value):
+    # Retry-After is either a number of seconds or a HTTP date
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Token bucket shared by all callers (threads) of one AwinClient.
+# Tokens are refilled at requests_per_minute / 60 per second up to the bucket size (burst).
+# A caller takes a token before each request; if the bucket is empty the token is
+# reserved (the bucket goes negative) and the caller sleeps until it is refilled, so
+# concurrent callers are queued in order instead of all firing when the bucket refills.
+class RateLimiter:
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, burst=1):
+        self.__rate = float(requests_per_minute) / 60
+        self.__burst = max(1, int(burst))
+        self.__tokens = float(self.__burst)
+        self.__updated = time.monotonic()
+        self.__blocked_until = 0.0
+        self.__lock = threading.Lock()
+        # endpoint: [waits, seconds waited]
+        self.__waits = {}
+
+    def acquire(self, endpoint=None):
+        wait = self.reserve(endpoint)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    # Take a token and return the seconds the caller has to wait before the request,
+    # without sleeping (e.g. for asyncio callers)
+    def reserve(self, endpoint=None):
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(
+                self.__burst,
+                self.__tokens + (now - self.__updated) * self.__rate)
+            self.__updated = now
+            self.__tokens -= 1
+            wait = 0.0
+            if self.__tokens < 0:
+                wait = -self.__tokens / self.__rate
+            wait = max(wait, self.__blocked_until - now)
+            if wait > 0:
+                waits = self.__waits.setdefault(endpoint, [0, 0.0])
+                waits[0] += 1
+                waits[1] += wait
+        return wait
+
+    # Block all callers for the given number of seconds (e.g. after a 429 response)
+    def pause(self, seconds):
+        with self.__lock:
+            now = time.monotonic()
+            self.__blocked_until = max(self.__blocked_until, now + seconds)
+            self.__tokens = min(self.__tokens, 0.0)
+            self.__updated = now
+
+    # Respect the rate limit headers of a response, if the API sends them
+    def update_from_headers(self, headers):
+        retry_after = parse_retry_after(headers.get('Retry-After'))
+        if retry_after:
+            self.pause(retry_after)
+            return retry_after
+
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        if remaining is not None and reset is not None:
+            try:
+                remaining = int(remaining)
+                reset = float(reset)
+            except ValueError:
+                return None
+            if remaining <= 0:
+                # Reset is either the seconds until the reset or a unix timestamp
+                if reset > time.time() / 2:
+                    reset = reset - time.time()
+                if reset > 0:
+                    self.pause(reset)
+                    return reset
+        return None
+
+    # Log the time added by the rate limiter as metrics (per endpoint)
+    def log_metrics(self):
+        with self.__lock:
+            waits = dict(self.__waits)
+        for endpoint, (count, seconds) in waits.items():
+            tags = {metrics.Tag.endpoint: endpoint}
+            metrics.log(LOGGER, metrics.Point('counter', 'rate_limit_waits', count, tags))
+            metrics.log(LOGGER, metrics.Point('timer', 'rate_limit_wait', seconds, tags))
@@ -0,0 +1,200 @@
+import random
+import threading
+import time
+
+import singer
+from singer import metrics
+
+LOGGER = singer.get_logger()
+
+# Tries of a request, the first request included
+DEFAULT_MAX_TRIES = 7
+# Backoff with full jitter: the delay before try n + 1 is a random number of seconds
+# between 0 and min(max_delay, BASE_DELAY * 2 ** (n - 1))
+BASE_DELAY = 3
+DEFAULT_MAX_DELAY = 60
+# Seconds all retries of a run may wait in total (backoff and Retry-After of 429 responses)
+DEFAULT_RETRY_BUDGET_SECONDS = 1800
+# Circuit breaker: error rate of the last requests of an endpoint that opens its circuit
+# (0 = disabled), and seconds the circuit stays open
+DEFAULT_BREAKER_THRESHOLD = 0
+DEFAULT_BREAKER_COOLDOWN = 60
+# Number of the last requests of an endpoint the error rate is computed of (at least
+# BREAKER_MIN_REQUESTS). A request counts once, with the outcome of its last try.
+BREAKER_WINDOW = 20
+BREAKER_MIN_REQUESTS = 5
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, endpoint, retry_in):
+        super().__init__('Circuit breaker of endpoint {} is open, retry in {:.0f}s'.format(
+            endpoint, retry_in))
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+# Circuit breaker of one endpoint:
+#   closed: requests are sent, the outcomes of the last BREAKER_WINDOW requests are kept
+#   open: when their error rate reaches the threshold, requests fail fast for cooldown seconds
+#   half open: after the cooldown one trial request is sent, which closes the circuit if
+#     it succeeds and opens it again if it fails (another trial is sent if it has no
+#     outcome within the cooldown, e.g. cancelled)
+# Not thread-safe, used with the lock of the RetryPolicy.
+class CircuitBreaker:
+    def __init__(self, endpoint, threshold, cooldown):
+        self.endpoint = endpoint
+        self.threshold = threshold
+        self.cooldown = cooldown
+        # 1 for each failed request, 0 for each successful one
+        self.outcomes = []
+        self.open_until = None
+        # End of the trial request of the half open circuit
+        self.trial_until = None
+        self.opened = 0
+        self.rejected = 0
+
+    # Seconds until a request is allowed, 0 if it is allowed now
+    def wait(self, now):
+        if self.open_until is None:
+            return 0
+        if now < self.open_until:
+            return self.open_until - now
+        # Half open, only one trial request at a time
+        if self.trial_until is not None and now < self.trial_until:
+            return self.trial_until - now
+        return 0
+
+    # Returns the seconds until a request is allowed, or 0 if the request may be sent
+    # (and takes the trial of a half open circuit)
+    def allow(self, now):
+        wait = self.wait(now)
+        if wait > 0:
+            self.rejected += 1
+        elif self.open_until is not None:
+            self.trial_until = now + self.cooldown
+        return wait
+
+    def record(self, failed, now):
+        if self.trial_until is not None:
+            self.trial_until = None
+            if failed:
+                self.open(now, 'the trial request failed')
+            else:
+                LOGGER.info('Circuit breaker of endpoint {} closed'.format(self.endpoint))
+                self.open_until = None
+                self.outcomes = []
+            return
+        if self.open_until is not None:
+            # Sent before the circuit opened
+            return
+
+        self.outcomes.append(1 if failed else 0)
+        if len(self.outcomes) > BREAKER_WINDOW:
+            del self.outcomes[0]
+        if len(self.outcomes) >= BREAKER_MIN_REQUESTS and \
+                sum(self.outcomes) >= self.threshold * len(self.outcomes):
+            self.open(now, '{} of the last {} requests failed'.format(
+                sum(self.outcomes), len(self.outcomes)))
+
+    def open(self, now, reason):
+        LOGGER.warning('Circuit breaker of endpoint {} opened for {:.0f}s ({})'.format(
+            self.endpoint, self.cooldown, reason))
+        self.open_until = now + self.cooldown
+        self.outcomes = []
+        self.opened += 1
+
+
+# Retries of the failed requests of a run, shared by all callers (threads, tasks) of a client:
+#   check(endpoint) before each request (not before its retries): raises CircuitOpenError if
+#     the circuit breaker of the endpoint is open (disabled with breaker_threshold 0)
+#   record(endpoint, failed) after the last try of each request: failed = the server or the
+#     connection failed
+#   retry_delay(endpoint, tries, error) after a retryable error: seconds to wait before the
+#     next try, or None if the error is raised (after max_tries tries, or if the wait
+#     exceeds the remaining retry budget)
+# The delay of an error with a retry_after (429 responses) is the retry_after, otherwise
+# exponential backoff with full jitter. budget_seconds = 0 disables the retry budget.
+class RetryPolicy:
+    def __init__(self,
+                 max_tries=DEFAULT_MAX_TRIES,
+                 max_delay=DEFAULT_MAX_DELAY,
+                 budget_seconds=DEFAULT_RETRY_BUDGET_SECONDS,
+                 breaker_threshold=DEFAULT_BREAKER_THRESHOLD,
+                 breaker_cooldown=DEFAULT_BREAKER_COOLDOWN):
+        self.max_tries = max(1, int(max_tries))
+        self.max_delay = float(max_delay)
+        self.budget_seconds = float(budget_seconds)
+        self.breaker_threshold = float(breaker_threshold)
+        self.breaker_cooldown = float(breaker_cooldown)
+        self.__budget_left = self.budget_seconds
+        self.__lock = threading.Lock()
+        # endpoint: CircuitBreaker
+        self.__breakers = {}
+        # endpoint: [retries, seconds waited, errors raised after retries]
+        self.__retries = {}
+
+    def __breaker(self, endpoint):
+        breaker = self.__breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.__breakers[endpoint] = CircuitBreaker(
+                endpoint, self.breaker_threshold, self.breaker_cooldown)
+        return breaker
+
+    def check(self, endpoint):
+        if not self.breaker_threshold:
+            return
+        with self.__lock:
+            wait = self.__breaker(endpoint).allow(time.monotonic())
+        if wait > 0:
+            raise CircuitOpenError(endpoint, wait)
+
+    def record(self, endpoint, failed):
+        if not self.breaker_threshold:
+            return
+        with self.__lock:
+            self.__breaker(endpoint).record(failed, time.monotonic())
+
+    # Seconds until the circuit breaker of the endpoint lets a request through
+    def open_seconds(self, endpoint):
+        if not self.breaker_threshold:
+            return 0
+        with self.__lock:
+            return self.__breaker(endpoint).wait(time.monotonic())
+
+    def retry_delay(self, endpoint, tries, error):
+        delay = getattr(error, 'retry_after', None)
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, BASE_DELAY * 2 ** (tries - 1)))
+        with self.__lock:
+            retries = self.__retries.setdefault(endpoint, [0, 0.0, 0])
+            if tries >= self.max_tries:
+                retries[2] += 1
+                return None
+            if self.budget_seconds:
+                if delay > self.__budget_left:
+                    retries[2] += 1
+                    LOGGER.warning('Retry budget of {}s exhausted, not retrying {} ({})'.format(
+                        self.budget_seconds, endpoint, type(error).__name__))
+                    return None
+                self.__budget_left -= delay
+            retries[0] += 1
+            retries[1] += delay
+        return delay
+
+    def log_metrics(self):
+        with self.__lock:
+            retries = dict(self.__retries)
+            breakers = [
+                (endpoint, breaker.opened, breaker.rejected)
+                for endpoint, breaker in self.__breakers.items() if breaker.opened]
+        for endpoint, (count, seconds, given_up) in retries.items():
+            tags = {metrics.Tag.endpoint: endpoint}
+            metrics.log(LOGGER, metrics.Point('counter', 'http_retries', count, tags))
+            metrics.log(LOGGER, metrics.Point(
+                'timer', 'http_retry_wait', round(seconds, 3), tags))
+            metrics.log(LOGGER, metrics.Point('counter', 'http_retries_exhausted', given_up, tags))
+        for endpoint, opened, rejected in breakers:
+            tags = {metrics.Tag.endpoint: endpoint}
+            metrics.log(LOGGER, metrics.Point('counter', 'circuit_breaker_opened', opened, tags))
+            metrics.log(LOGGER, metrics.Point(
+                'counter', 'circuit_breaker_rejected', rejected, tags))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import sys
+import zlib
+
+import singer
+
+LOGGER = singer.get_logger()
+
+
+# Stable shard of an account (the same in every process and run, unlike hash())
+def get_shard(account_id, shard_count):
+    return zlib.crc32(str(account_id).encode('utf-8')) % shard_count
+
+
+def in_shard(account_id, shard_index=0, shard_count=1):
+    if shard_count <= 1:
+        return True
+    return get_shard(account_id, shard_count) == shard_index
+
+
+def validate_shard_config(shard_index, shard_count):
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        raise ValueError('Invalid shard config: shard_index {} of shard_count {}'.format(
+            shard_index, shard_count))
+
+
+# Merge the leaves of b into a (a is modified); conflicting leaves are resolved by resolve
+def merge_dicts(a, b, resolve):
+    for key, value in b.items():
+        if key not in a:
+            a[key] = value
+        elif isinstance(a[key], dict) and isinstance(value, dict):
+            merge_dicts(a[key], value, resolve)
+        elif a[key] != value:
+            a[key] = resolve(a[key], value)
+    return a
+
+
+# Merge the states of the shards of a sync into one state.
+# The bookmarks are keyed by account (parent id), so the states of the shards do not overlap.
+# If they do (e.g. after the shard_count was changed), the lower bookmark is kept, so that no
+# records are skipped. currently_syncing is dropped.
+def merge_states(states):
+    merged = {}
+    for state in states:
+        state = dict(state)
+        state.pop('currently_syncing', None)
+        bookmarks = state.pop('bookmarks', {})
+        merge_dicts(merged.setdefault('bookmarks', {}), bookmarks, min)
+        merge_dicts(merged, state, lambda first, _: first)
+    return merged
+
+
+# Usage: tap-awin-advertiser-merge-states state_shard_0.json state_shard_1.json ... > state.json
+def main():
+    parser = argparse.ArgumentParser(description='Merge the states of sharded syncs')
+    parser.add_argument('states', nargs='+', help='state files of the shards')
+    args = parser.parse_args()
+
+    states = []
+    for path in args.states:
+        with open(path) as file:
+            states.append(json.load(file))
+    json.dump(merge_states(states), sys.stdout)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
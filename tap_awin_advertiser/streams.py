@@ -9,6 +9,16 @@
 #   data_key: JSON element containing the records for the endpoint
 #   api_method: GET or POST; default = 'GET'
 #   params: Query, sort, and other endpoint specific parameters; default = {}
+#   date_window_size: Number of days in each date window (for bookmark_query_field_from/to)
+#   max_date_window_size: Maximum date_window_size of the API (for adaptive date windows)
+#   shard_key: Field by which the records (and their children) are assigned to shards
+#   bookmark_query_date_format: strftime format of the bookmark_query_field_from/to values;
+#        default = the start and the end of the day as date-time
+#   window_date_field: Field set to the date of the window in each record, for reports that
+#        aggregate the requested date range (requested for single days)
+#   config_params: Query parameters (param: config property) set from the tap config
+#   validation_pass: Properties replaced for the second pass of the validation_delta mode,
+#        over the records validated since the last sync
 
 STREAMS = {
     # Reference: https://wiki.awin.com/index.php/API_get_accounts
@@ -17,6 +27,7 @@ STREAMS = {
         'replication_method': 'FULL_TABLE',
         'path': 'accounts',
         'data_key_array': 'accounts',
+        'shard_key': 'account_id',
         'params': {
             'type': 'advertiser'
         },
@@ -37,10 +48,37 @@ STREAMS = {
                 'bookmark_query_field_to': 'endDate',
                 'path': 'advertisers/{parent_id}/transactions/',
                 'date_window_size': 30,
+                # The API allows a date range of at most 31 days
+                'max_date_window_size': 30,
                 'parent': 'advertiser_id',
                 'params': {
                     'timezone': 'UTC',
                     'dateType': 'transaction'
+                },
+                'validation_pass': {
+                    'replication_keys': ['validation_date'],
+                    'params': {
+                        'timezone': 'UTC',
+                        'dateType': 'validation'
+                    }
+                }
+            },
+            # Reference: https://wiki.awin.com/index.php/API_get_publisher_performance
+            'publisher_performance_report': {
+                'key_properties': ['advertiser_id', 'publisher_id', 'region', 'report_date'],
+                'replication_method': 'INCREMENTAL',
+                'replication_keys': ['report_date'],
+                'bookmark_query_field_from': 'startDate',
+                'bookmark_query_field_to': 'endDate',
+                'bookmark_query_date_format': '%Y-%m-%d',
+                'path': 'advertisers/{parent_id}/reports/publisher',
+                'window_date_field': 'report_date',
+                'parent': 'advertiser_id',
+                'params': {
+                    'timezone': 'UTC'
+                },
+                'config_params': {
+                    'region': 'report_region'
                 }
             }
         }
@@ -48,6 +86,7 @@ STREAMS = {
 }
 
 # De-nest children nodes for Discovery mode
+# The children get a parent_stream property; STREAMS is not modified (copies)
 def flatten_streams():
     flat_streams = {}
     # Loop through parents
@@ -57,7 +96,7 @@ def flatten_streams():
         children = endpoint_config.get('children')
         if children:
             for child_stream_name, child_endpoint_config in children.items():
-                flat_streams[child_stream_name] = child_endpoint_config
-                flat_streams[child_stream_name]['parent_stream'] = stream_name
+                flat_streams[child_stream_name] = dict(
+                    child_endpoint_config, parent_stream=stream_name)
 
     return flat_streams
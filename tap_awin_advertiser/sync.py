@@ -1,30 +1,76 @@
+import contextlib
+import itertools
 import math
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 import pytz
-import humps
 
 import singer
-from singer import metrics, metadata, Transformer, utils
+from singer import metrics, metadata, utils
 from singer.utils import strptime_to_utc, strftime
 
+from tap_awin_advertiser.cache import CACHE_FOREVER, DEFAULT_CACHE_TTL, NO_CACHE
+from tap_awin_advertiser.change_detection import (
+    ChangeDetector, FingerprintStore, DELETED_AT_FIELD, DELETED_AT_SCHEMA)
+from tap_awin_advertiser.date_windows import (
+    AdaptiveDateWindow, DEFAULT_TARGET_RECORDS, DEFAULT_MAX_SECONDS)
+from tap_awin_advertiser.dedup import Deduplicator
+from tap_awin_advertiser.output import SingerWriter, DEFAULT_BATCH_SIZE
+from tap_awin_advertiser.retry import CircuitOpenError
+from tap_awin_advertiser.sharding import in_shard, validate_shard_config
+from tap_awin_advertiser.profiling import (
+    PROFILER, DECAMELIZE, TRANSFORM, BOOKMARK, WRITE, PREFETCH_WAIT)
 from tap_awin_advertiser.streams import flatten_streams, STREAMS
+from tap_awin_advertiser.transform import decamelize, parse_datetime, RecordTransformer
 
 LOGGER = singer.get_logger()
 BASE_URL = 'https://api.awin.com'
+DEFAULT_RESUME_MAX_AGE_HOURS = 24
+DEFAULT_PREFETCH_WINDOWS = 0
+# Days of the reports (one request per day and account) synced again by each run
+DEFAULT_REPORT_ATTRIBUTION_WINDOW = 3
+# Tries of a parent id deferred by an open circuit breaker, each after the cooldown;
+# afterwards the parent id is skipped (its bookmarks are not updated)
+DEFERRED_TRIES = 3
+# Seconds a blocked prefetch producer waits before it checks whether it was stopped
+PREFETCH_POLL_SECONDS = 0.5
+
+# Child streams of several parent records may be synced concurrently. All Singer
+# output and every change of the shared state goes through this lock, so that
+# messages are never interleaved and a STATE message always serializes a
+# consistent state.
+WRITE_LOCK = threading.RLock()
+
+# Buffered Singer output (stdout), configured in sync()
+WRITER = SingerWriter()
+
+# Fingerprints of the records of the streams with change detection, configured in sync()
+FINGERPRINTS = FingerprintStore()
+
+# Ids of the records written by this run of the streams with deduplication, configured in sync()
+DEDUPLICATOR = Deduplicator()
 
 
 def write_schema(catalog, stream_name):
     stream = catalog.get_stream(stream_name)
     schema = stream.schema.to_dict()
+    if FINGERPRINTS.tombstones and FINGERPRINTS.enabled(stream_name):
+        schema.setdefault('properties', {})[DELETED_AT_FIELD] = DELETED_AT_SCHEMA
     try:
-        singer.write_schema(stream_name, schema, stream.key_properties)
+        with WRITE_LOCK:
+            WRITER.write_schema(stream_name, schema, stream.key_properties)
     except OSError as err:
         LOGGER.error('OS Error writing schema for: {}'.format(stream_name))
         raise err
 
 def write_record(stream_name, record, time_extracted):
     try:
-        singer.messages.write_record(stream_name, record, time_extracted=time_extracted)
+        with WRITE_LOCK, PROFILER.stage(stream_name, WRITE):
+            WRITER.write_record(stream_name, record, time_extracted=time_extracted)
     except OSError as err:
         LOGGER.error('OS Error writing record for: {}'.format(stream_name))
         LOGGER.error('Stream: {}, record: {}'.format(stream_name, record))
@@ -53,280 +99,793 @@ def get_bookmark(state, stream, default, bookmark_field=None, parent=None, paren
         .get(key, default)
     )
 
-def write_bookmark(state, stream, value, bookmark_field=None, parent=None, parent_id=None):
+# Set a bookmark value, without writing the state
+def update_bookmark(state, stream, value, bookmark_field=None, parent=None, parent_id=None):
     if parent and parent_id:
         key = '{}(parent_{}:{})'.format(bookmark_field, parent, parent_id)
     else:
         key = bookmark_field
-    if 'bookmarks' not in state:
-        state['bookmarks'] = {}
-    if stream not in state['bookmarks']:
-        state['bookmarks'][stream] = {}
+    with WRITE_LOCK:
+        if 'bookmarks' not in state:
+            state['bookmarks'] = {}
+        if stream not in state['bookmarks']:
+            state['bookmarks'][stream] = {}
+
+        state['bookmarks'][stream][key] = value
 
-    state['bookmarks'][stream][key] = value
-    LOGGER.info('Write state for Stream: {}, {} ID: {}, value: {}'.format(
-        stream, parent, parent_id, value))
-    singer.write_state(state)
+def write_bookmark(state, stream, value, bookmark_field=None, parent=None, parent_id=None):
+    with WRITE_LOCK:
+        update_bookmark(state, stream, value, bookmark_field, parent, parent_id)
+        LOGGER.info('Write state for Stream: {}, {} ID: {}, value: {}'.format(
+            stream, parent, parent_id, value))
+        with PROFILER.stage(stream, WRITE):
+            WRITER.write_state(state)
+
+# Record transformers, compiled once per catalog stream and reused for the whole run
+RECORD_TRANSFORMERS = {}
+
+def get_record_transformer(catalog, stream_name):
+    stream = catalog.get_stream(stream_name)
+    with WRITE_LOCK:
+        cached = RECORD_TRANSFORMERS.get(stream_name)
+        if cached is None or cached[0] is not stream:
+            transformer = RecordTransformer(
+                stream.schema.to_dict(),
+                metadata.to_map(stream.metadata))
+            cached = (stream, transformer)
+            RECORD_TRANSFORMERS[stream_name] = cached
+    return cached[1]
 
 def process_records(catalog, #pylint: disable=too-many-branches
                     stream_name,
                     records,
                     time_extracted,
                     bookmark_field=None,
-                    max_bookmark_value=None,
-                    last_datetime=None):
-    stream = catalog.get_stream(stream_name)
-    schema = stream.schema.to_dict()
-    stream_metadata = metadata.to_map(stream.metadata)
+                    max_bookmark_dttm=None,
+                    change_detector=None,
+                    seen_ids=None):
+    transformer = get_record_transformer(catalog, stream_name)
 
     with metrics.record_counter(stream_name) as counter:
         for record in records:
+            # Skip the records already written by this run, before they are transformed
+            if seen_ids is not None and not seen_ids.add(record.get('id')):
+                continue
+
             # Transform record for Singer.io
-            with Transformer() as transformer:
-                transformed_record = transformer.transform(
-                    record,
-                    schema,
-                    stream_metadata)
-
-                # Reset max_bookmark_value to new value if higher
-                if bookmark_field and (bookmark_field in transformed_record):
+            with PROFILER.stage(stream_name, TRANSFORM):
+                transformed_record = transformer.transform(record)
+
+            # Skip the records that did not change since the last sync
+            if change_detector is not None and not change_detector.changed(transformed_record):
+                continue
+
+            # Reset max_bookmark_dttm to new value if higher
+            # The bookmark is parsed once and kept as datetime; it is formatted for the state only
+            if bookmark_field:
+                with PROFILER.stage(stream_name, BOOKMARK):
                     bookmark_date = transformed_record.get(bookmark_field)
-                    bookmark_dttm = strptime_to_utc(bookmark_date)
-                    last_dttm = strptime_to_utc(last_datetime)
+                    if bookmark_date:
+                        bookmark_dttm = parse_datetime(bookmark_date)
+                        if max_bookmark_dttm is None or bookmark_dttm > max_bookmark_dttm:
+                            max_bookmark_dttm = bookmark_dttm
 
-                    if not max_bookmark_value:
-                        max_bookmark_value = last_datetime
+            # LOGGER.info('record: {}'.format(record)) # TESTING, comment out
+            write_record(stream_name, transformed_record, time_extracted=time_extracted)
+            counter.increment()
 
-                    max_bookmark_dttm = strptime_to_utc(max_bookmark_value)
+        LOGGER.info('Stream: {}, Processed {} records'.format(stream_name, counter.value))
+        return max_bookmark_dttm, counter.value
 
-                    if bookmark_dttm > max_bookmark_dttm:
-                        max_bookmark_value = strftime(bookmark_dttm)
+# Write tombstones for the deleted records (if configured) and keep the fingerprints of the
+# records of the parent for the next sync
+def finish_change_detection(stream_name, parent_id, change_detector):
+    fingerprints = change_detector.fingerprints()
+    deleted_ids = change_detector.deleted_ids(fingerprints)
+    LOGGER.info('Stream: {}, parent_id: {}, unchanged records: {}, deleted records: {}'.format(
+        stream_name, parent_id, change_detector.unchanged, len(deleted_ids)))
+    tags = {metrics.Tag.endpoint: stream_name}
+    metrics.log(LOGGER, metrics.Point(
+        'counter', 'unchanged_records', change_detector.unchanged, tags))
 
-                    # LOGGER.info('record1: {}'.format(record)) # TESTING, comment out
-                    write_record(stream_name, transformed_record, \
-                        time_extracted=time_extracted)
-                    counter.increment()
-                else:
-                    # LOGGER.info('record2: {}'.format(record)) # TESTING, comment out
-                    write_record(stream_name, transformed_record, time_extracted=time_extracted)
-                    counter.increment()
+    if FINGERPRINTS.tombstones and deleted_ids:
+        if change_detector.hashed_ids:
+            LOGGER.warning('Stream: {}, no tombstones, the ids are not integers'.format(
+                stream_name))
+        else:
+            deleted_at = strftime(utils.now())
+            for record_id in deleted_ids:
+                write_record(
+                    stream_name,
+                    {change_detector.key_field: record_id, DELETED_AT_FIELD: deleted_at},
+                    time_extracted=None)
 
-        LOGGER.info('Stream: {}, Processed {} records'.format(stream_name, counter.value))
-        return max_bookmark_value, counter.value
+    FINGERPRINTS.set(stream_name, parent_id, fingerprints)
 
-# Sync a specific parent or child endpoint.
-def sync_endpoint(
-        client,
-        config,
-        catalog,
-        state,
-        stream_name,
-        endpoint_config,
-        sync_streams,
-        selected_streams,
-        parent_id=None):
+# Add the parent id to the API records and decamelize the keys
+def transform_records(records, parent=None, parent_id=None, stream_name=None):
+    for record in records:
+        # Add parent id field/value
+        if parent and parent_id and parent not in record:
+            record[parent] = parent_id
 
-    # endpoint_config variables
-    base_path = endpoint_config.get('path', stream_name)
-    bookmark_field = next(iter(endpoint_config.get('replication_keys', [])), None)
-    params = endpoint_config.get('params', {})
-    bookmark_query_field_from = endpoint_config.get('bookmark_query_field_from')
-    bookmark_query_field_to = endpoint_config.get('bookmark_query_field_to')
-    data_key_array = endpoint_config.get('data_key_array')
-    id_fields = endpoint_config.get('key_properties')
-    parent = endpoint_config.get('parent')
-    date_window_size = int(endpoint_config.get('date_window_size', '1'))
-
-    # tap config variabless
-    start_date = config.get('start_date')
-    attribution_window = config.get('attribution_window', 30)
-
-    last_datetime = get_bookmark(state, stream_name, start_date, bookmark_field, parent, parent_id)
-    max_bookmark_value = last_datetime
-
-    # Convert to datetimes in local/ad account timezone
-    now_datetime = utils.now()
-    last_dttm = strptime_to_utc(last_datetime)
-
-    if bookmark_query_field_from and bookmark_query_field_to:
-        # date_window_size: Number of days in each date window
-        # Set start window
-        start_window = now_datetime - timedelta(days=attribution_window)
-        if last_dttm < start_window:
-            start_window = last_dttm + timedelta(days=1) # makes sure that we don't have duplicated data
-        # Set end window
-        end_window = start_window + timedelta(days=date_window_size)
-        if end_window > now_datetime:
-            end_window = now_datetime
+        # transform record (remove inconsistent use of CamelCase)
+        try:
+            with PROFILER.stage(stream_name, DECAMELIZE):
+                transformed_record = decamelize(record)
+        except Exception as err:
+            LOGGER.error('{}'.format(err))
+            LOGGER.error('error record: {}'.format(record))
+            raise Exception(err)
 
-    else:
-        start_window = last_dttm
-        end_window = now_datetime
-        diff_sec = (end_window - start_window).seconds
-        date_window_size = math.ceil(diff_sec / (3600 * 24)) # round-up difference to days
+        yield transformed_record
+
+
+# Return an iterator over the records, or None if there are no records
+def peek_records(records):
+    records = iter(records)
+    first_record = next(records, None)
+    if first_record is None:
+        return None
+    return itertools.chain([first_record], records)
 
-    endpoint_total = 0
-    total_records = 0
 
+# Date windows (start_window, end_window) from the start window up to now
+# date_window_size: number of days or an AdaptiveDateWindow (size read for each window)
+def get_date_windows(start_window, end_window, now_datetime, date_window_size):
     while start_window < now_datetime:
-        LOGGER.info('START Sync for Stream: {}{}'.format(
+        yield start_window, end_window
+
+        # Increment date window
+        start_window = end_window + timedelta(days=1)
+        next_end_window = end_window + timedelta(
+            days=getattr(date_window_size, 'days', date_window_size))
+        if next_end_window > now_datetime:
+            end_window = now_datetime
+        else:
+            end_window = next_end_window
+
+
+# Single day date windows (day, day) from the start window up to today
+def get_day_windows(start_window, now_datetime):
+    while start_window.date() <= now_datetime.date():
+        yield start_window, start_window
+        start_window = start_window + timedelta(days=1)
+
+
+# Set the field to the value in each of the records
+def set_field(records, field, value):
+    for record in records:
+        record[field] = value
+        yield record
+
+
+# Call fetch for each of the windows and yield (window, result) in window order.
+# With more than one worker, the following windows are fetched concurrently while
+# the current one is processed by the caller.
+def fetch_in_order(fetch, windows, workers=1):
+    if workers <= 1:
+        for window in windows:
+            yield window, fetch(window)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='window') as executor:
+        pending = deque()
+        try:
+            for window in windows:
+                pending.append((window, executor.submit(fetch, window)))
+                if len(pending) >= workers:
+                    window, future = pending.popleft()
+                    yield window, future.result()
+            while pending:
+                window, future = pending.popleft()
+                yield window, future.result()
+        finally:
+            # Do not start fetches for the remaining windows after an error
+            for _, future in pending:
+                future.cancel()
+
+
+# Iterate the iterable in a producer thread, at most size items ahead of the consumer
+# (bounded queue, the producer waits while it is full). The items are yielded in order;
+# an exception of the producer is raised in the consumer at its position.
+# When the consumer stops early (error, closed), the producer stops before its next item.
+# The time the consumer waits for the producer is profiled as stage prefetch_wait.
+def prefetch(iterable, size, stream_name=None):
+    if size <= 0:
+        yield from iterable
+        return
+
+    items = queue.Queue(maxsize=size)
+    stopped = threading.Event()
+    end = object()
+
+    # Returns False if the consumer stopped
+    def put(entry):
+        while not stopped.is_set():
+            try:
+                items.put(entry, timeout=PREFETCH_POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    return
+            put((end, None))
+        except Exception as err: # pylint: disable=broad-except
+            put((None, err))
+        finally:
+            # e.g. cancel the pending fetches of fetch_in_order
+            close = getattr(iterator, 'close', None)
+            if close:
+                close()
+
+    producer = threading.Thread(
+        target=produce, name='prefetch-{}'.format(stream_name), daemon=True)
+    producer.start()
+    try:
+        while True:
+            with PROFILER.stage(stream_name, PREFETCH_WAIT):
+                item, error = items.get()
+            if error is not None:
+                raise error
+            if item is end:
+                return
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
+
+
+# Settings and progress of the sync of one endpoint (and parent id), shared by the
+# threaded engine (sync_endpoint) and the asyncio engine (async_sync.sync_endpoint_async):
+#   windows(): date windows to fetch
+#   window_request(window): url and cache_ttl of the request of a window
+#   process_data(...): process the response of each window, in window order
+#   finish_window(...): after the child streams of the window are synced
+#   finish(): after the last window
+class EndpointSync:
+    def __init__(
+            self,
+            client,
+            config,
+            catalog,
+            state,
             stream_name,
-            ', Date window from: {} to {}'.format(start_window.date(), end_window.date()) \
-                if bookmark_query_field_from else ''))
+            endpoint_config,
+            sync_streams,
+            selected_streams,
+            parent_id=None):
+        self.catalog = catalog
+        self.state = state
+        self.stream_name = stream_name
+        self.endpoint_config = endpoint_config
+        self.sync_streams = sync_streams
+        self.selected_streams = selected_streams
+        self.parent_id = parent_id
+
+        # endpoint_config variables
+        base_path = endpoint_config.get('path', stream_name)
+        self.bookmark_field = next(iter(endpoint_config.get('replication_keys', [])), None)
+        # copy, params are modified per date window and may be used by concurrent syncs
+        self.params = dict(endpoint_config.get('params', {}))
+        for param, config_key in endpoint_config.get('config_params', {}).items():
+            if config.get(config_key):
+                self.params[param] = config[config_key]
+        self.bookmark_query_field_from = endpoint_config.get('bookmark_query_field_from')
+        self.bookmark_query_field_to = endpoint_config.get('bookmark_query_field_to')
+        self.bookmark_query_date_format = endpoint_config.get('bookmark_query_date_format')
+        self.window_date_field = endpoint_config.get('window_date_field')
+        self.data_key_array = endpoint_config.get('data_key_array')
+        self.id_fields = endpoint_config.get('key_properties')
+        self.parent = endpoint_config.get('parent')
+        self.shard_key = endpoint_config.get('shard_key')
+        # validation_delta mode: 'validation' for the pass over the validated records
+        self.pass_name = endpoint_config.get('pass_name')
+        self.delta = bool(self.pass_name) or (
+            config.get('validation_delta', False) and 'validation_pass' in endpoint_config)
+        date_window_size = int(endpoint_config.get('date_window_size', '1'))
+
+        # tap config variabless
+        start_date = config.get('start_date')
+        attribution_window = config.get('attribution_window', 30)
+        # config report_attribution_window: the attribution window of the reports of
+        #   single days (window_date_field), each day synced again is one request
+        if self.window_date_field:
+            attribution_window = config.get(
+                'report_attribution_window', DEFAULT_REPORT_ATTRIBUTION_WINDOW)
+        self.shard_index = int(config.get('shard_index', 0))
+        self.shard_count = int(config.get('shard_count', 1))
+
+        self.now_datetime = utils.now()
+
+        # Without a bookmark, the validation pass starts at the attribution window (like a
+        # sync without validation_delta), so no validation is missed when the mode is enabled
+        default_datetime = start_date
+        if self.pass_name:
+            default_datetime = strftime(self.now_datetime - timedelta(days=attribution_window))
+        last_datetime = get_bookmark(
+            state, stream_name, default_datetime, self.bookmark_field, self.parent, parent_id) \
+            or default_datetime
+
+        # Units without child streams (stream, parent id and date windows) that were
+        # finished by an interrupted sync are skipped, see get_resume_cursor
+        self.resume = 'resume' in state and not endpoint_config.get('children')
+        self.resume_stream = '{}({})'.format(stream_name, self.pass_name) \
+            if self.pass_name else stream_name
+        self.resume_cursor = None
+        if self.resume:
+            self.resume_cursor = get_resume_cursor(state, self.resume_stream, parent_id)
+
+        # Convert to datetimes in local/ad account timezone
+        last_dttm = strptime_to_utc(last_datetime)
+        self.max_bookmark_dttm = last_dttm
+
+        if self.bookmark_query_field_from and self.bookmark_query_field_to:
+            # date_window_size: Number of days in each date window
+            # config adaptive_date_window: adapt the window size of each parent to the responses,
+            #   the size is kept in the state for the next run
+            self.adaptive_window = None
+            if config.get('adaptive_date_window', False) and not self.pass_name and \
+                    not self.window_date_field:
+                self.adaptive_window = AdaptiveDateWindow(
+                    get_bookmark(state, stream_name, date_window_size, 'date_window_size', \
+                        self.parent, parent_id),
+                    max_days=endpoint_config.get('max_date_window_size'),
+                    target_records=config.get(
+                        'date_window_target_records', DEFAULT_TARGET_RECORDS),
+                    max_seconds=config.get('date_window_max_seconds', DEFAULT_MAX_SECONDS))
+                date_window_size = self.adaptive_window.days
+
+            # Set start window
+            if self.delta:
+                # The attribution window is not synced again, the changes of the transactions
+                # are synced by the validation pass. The day of the bookmark is synced again.
+                start_window = last_dttm
+            else:
+                start_window = self.now_datetime - timedelta(days=attribution_window)
+                if last_dttm < start_window:
+                    start_window = last_dttm + timedelta(days=1) # makes sure that we don't have duplicated data
+            # Continue after the last window finished by an interrupted sync
+            if self.resume_cursor:
+                start_window = max(
+                    start_window, strptime_to_utc(self.resume_cursor) + timedelta(days=1))
+            # Set end window
+            end_window = start_window + timedelta(days=date_window_size)
+            if end_window > self.now_datetime:
+                end_window = self.now_datetime
+
+        else:
+            self.adaptive_window = None
+            start_window = last_dttm
+            end_window = self.now_datetime
+            diff_sec = (end_window - start_window).seconds
+            date_window_size = math.ceil(diff_sec / (3600 * 24)) # round-up difference to days
 
-        if bookmark_query_field_from and bookmark_query_field_to:
+        self.start_window = start_window
+        self.end_window = end_window
+        self.date_window_size = date_window_size
+        # Endpoints without date windows are finished as a whole
+        self.skip = bool(self.resume_cursor) and not self.bookmark_query_field_from
+        if self.skip or (self.resume_cursor and start_window > self.now_datetime):
+            LOGGER.info('Stream: {}, parent_id: {}, finished by the interrupted sync'.format(
+                stream_name, parent_id))
+
+        self.endpoint_total = 0
+        self.total_records = 0
+
+        self.url = '{}/{}'.format(client.base_url, base_path.format(parent_id=parent_id))
+
+        # config cache_ttl: seconds responses of the stream are served from the response cache
+        self.cache_ttl = config.get('cache_ttl', {}).get(
+            stream_name, DEFAULT_CACHE_TTL.get(stream_name, NO_CACHE))
+        self.closed_window_end = (self.now_datetime - timedelta(days=attribution_window)).date()
+
+        # config change_detection: FULL_TABLE streams of which only new and changed records
+        #   are written, compared by a fingerprint per record and parent id
+        self.change_detector = None
+        if FINGERPRINTS.enabled(stream_name) and not self.bookmark_field and \
+                stream_name in sync_streams and not self.skip:
+            self.change_detector = ChangeDetector(
+                FINGERPRINTS.get(stream_name, parent_id), self.id_fields[0])
+
+        # config deduplicate: streams of which the records with an id (per parent id) that was
+        #   already written by this run are skipped
+        self.seen_ids = None
+        self.known_duplicates = 0
+        if DEDUPLICATOR.enabled(stream_name) and 'id' in (self.id_fields or []):
+            self.seen_ids = DEDUPLICATOR.get(stream_name, parent_id)
+            self.known_duplicates = self.seen_ids.duplicates
+
+        # config stream_json: decode the records of a response incrementally
+        #   (not for data_key_array)
+        self.stream_json = config.get('stream_json', False) and not self.data_key_array
+
+        # config window_workers: number of date windows fetched concurrently; default = 1 (serial)
+        # Windows are processed (and bookmarked) in order, so the bookmark only moves
+        # forward over windows for which all earlier windows are finished.
+        self.window_workers = 1
+        if self.bookmark_query_field_from and self.bookmark_query_field_to:
+            self.window_workers = int(config.get('window_workers', 1))
+
+        # config prefetch_windows: number of date windows fetched ahead by a producer thread
+        #   while the current window is processed (in addition to the window_workers)
+        self.prefetch_windows = 0
+        if self.bookmark_query_field_from and self.bookmark_query_field_to:
+            self.prefetch_windows = int(config.get('prefetch_windows', DEFAULT_PREFETCH_WINDOWS))
+
+    def windows(self):
+        if self.skip:
+            return iter(())
+        if self.window_date_field:
+            return get_day_windows(self.start_window, self.now_datetime)
+        return get_date_windows(
+            self.start_window,
+            self.end_window,
+            self.now_datetime,
+            self.adaptive_window or self.date_window_size)
+
+    # URL and cache_ttl of the API request of a date window
+    def window_request(self, window):
+        window_start, window_end = window
+        LOGGER.info('START Sync for Stream: {}{}{}'.format(
+            self.stream_name,
+            ', Date window from: {} to {}'.format(window_start.date(), window_end.date()) \
+                if self.bookmark_query_field_from else '',
+            ' ({})'.format(self.pass_name) if self.pass_name else ''))
+
+        # copy, windows may be fetched concurrently
+        window_params = dict(self.params)
+        window_cache_ttl = self.cache_ttl
+        if self.bookmark_query_field_from and self.bookmark_query_field_to:
             # Query parameter startDate and endDate must be in Eastern time zone
             # API will error if future dates are requested
 
             # DAY based
-            window_start_dt_str = start_window.date().strftime('%Y-%m-%dT00:00:00')
-            window_end_dt_str = end_window.date().strftime('%Y-%m-%dT23:59:59')
-
-            params[bookmark_query_field_from] = window_start_dt_str
-            params[bookmark_query_field_to] = window_end_dt_str
+            window_start_dt_str = window_start.date().strftime(
+                self.bookmark_query_date_format or '%Y-%m-%dT00:00:00')
+            window_end_dt_str = window_end.date().strftime(
+                self.bookmark_query_date_format or '%Y-%m-%dT23:59:59')
 
-        path = base_path.format(
-            parent_id=parent_id)
+            window_params[self.bookmark_query_field_from] = window_start_dt_str
+            window_params[self.bookmark_query_field_to] = window_end_dt_str
 
-        total_records = 0
+            # Date windows before the attribution window do not change anymore
+            if window_end.date() < self.closed_window_end:
+                window_cache_ttl = CACHE_FOREVER
 
         # concate params
-        querystring = '&'.join(['%s=%s' % (key, value) for (key, value) in params.items()])
+        querystring = '&'.join(['%s=%s' % (key, value) for (key, value) in window_params.items()])
 
         # initialize url
-        url = '{}/{}?{}'.format(
-            client.base_url,
-            path,
-            querystring)
+        url = '{}?{}'.format(self.url, querystring)
+        return url, window_cache_ttl
+
+    # Process the response (data) of a date window.
+    # Returns the transformed records (a list, if the endpoint has child streams),
+    # or None if the response has no records.
+    def process_data(self, data, time_extracted, window=None):
+        self.total_records = 0
+
+        if not data or data is None or data == {}:
+            LOGGER.info('No data results returned')
+            return None
+
+        # Transform data with transform_json from transform.py
+        # The data_key_array identifies the array/list of records below the <root> element
+        # LOGGER.info('data = {}'.format(data)) # TESTING, comment out
+        if self.data_key_array:
+            data_records = data.get(self.data_key_array, [])
+        else:
+            data_records = data
+
+        transformed_data = transform_records(
+            data_records, self.parent, self.parent_id, self.stream_name)
+        if self.window_date_field:
+            # Reports of single days (see get_day_windows)
+            transformed_data = set_field(
+                transformed_data,
+                self.window_date_field,
+                strftime(window[0].replace(hour=0, minute=0, second=0, microsecond=0)))
+        if self.shard_key and self.shard_count > 1:
+            # Only the records (accounts) of this shard and their child streams are synced
+            transformed_data = (
+                record for record in transformed_data \
+                    if in_shard(record.get(self.shard_key), self.shard_index, self.shard_count))
+        if self.stream_json and not self.endpoint_config.get('children'):
+            # Records are transformed and processed one by one while the response is read
+            transformed_data = peek_records(transformed_data)
+        else:
+            transformed_data = list(transformed_data)
+
+        # LOGGER.info('transformed_data = {}'.format(transformed_data)) # COMMENT OUT
+        if not transformed_data or transformed_data is None:
+            LOGGER.info('No transformed data for data = {}'.format(data))
+            return None
+
+        # Process records and get the max_bookmark_dttm and record_count
+        if self.stream_name in self.sync_streams:
+            self.max_bookmark_dttm, record_count = process_records(
+                catalog=self.catalog,
+                stream_name=self.stream_name,
+                records=transformed_data,
+                time_extracted=time_extracted,
+                bookmark_field=self.bookmark_field,
+                max_bookmark_dttm=self.max_bookmark_dttm,
+                change_detector=self.change_detector,
+                seen_ids=self.seen_ids)
+            LOGGER.info('Stream {}, batch processed {} records'.format(
+                self.stream_name, record_count))
+            self.total_records = record_count
+
+        return transformed_data
+
+    # Child streams to sync for the records of a date window: (stream_name, endpoint_config)
+    def child_streams(self):
+        children = self.endpoint_config.get('children') or {}
+        for child_stream_name, child_endpoint_config in children.items():
+            if child_stream_name in self.sync_streams:
+                yield child_stream_name, child_endpoint_config
+
+    def parent_ids(self, records):
+        return [get_parent_id(record, self.id_fields) for record in records]
+
+    # Called after the records (returned by process_data) and their child streams are synced.
+    # server_seconds: response time of the API request of the window (0 if it was cached)
+    def finish_window(self, window, records, server_seconds):
+        if self.resume and self.bookmark_query_field_from:
+            update_resume_cursor(
+                self.state, self.resume_stream, self.parent_id, strftime(window[1]))
+
+        if records is not None:
+            # Parent record batch
+            self.endpoint_total = self.endpoint_total + self.total_records
+
+            LOGGER.info('Synced Stream: {}, records: {}'.format(
+                self.stream_name,
+                self.total_records))
+
+            # Update the state with the max_bookmark_dttm for the stream date window
+            # Snapchat Ads API does not allow page/batch sorting; bookmark written for date window
+            if self.bookmark_field and self.stream_name in self.selected_streams and \
+                    not self.pass_name:
+                write_bookmark(self.state, self.stream_name, strftime(self.max_bookmark_dttm),
+                               self.bookmark_field, self.parent, self.parent_id)
+
+        # The validation pass continues after the last date window, also if no records
+        # were validated in it (most records have no validation date yet)
+        if self.pass_name and self.stream_name in self.selected_streams:
+            write_bookmark(self.state, self.stream_name, strftime(window[1]),
+                           self.bookmark_field, self.parent, self.parent_id)
+
+        # Adapt the size of the following date windows to this response
+        if self.adaptive_window and \
+                self.adaptive_window.update(self.total_records, server_seconds):
+            update_bookmark(self.state, self.stream_name, self.adaptive_window.days, \
+                'date_window_size', self.parent, self.parent_id)
+
+    # Returns the total number of records
+    def finish(self):
+        if self.seen_ids is not None:
+            duplicates = self.seen_ids.duplicates - self.known_duplicates
+            LOGGER.info('Stream: {}, parent_id: {}, duplicate records skipped: {}'.format(
+                self.stream_name, self.parent_id, duplicates))
+            metrics.log(LOGGER, metrics.Point(
+                'counter', 'duplicate_records', duplicates,
+                {metrics.Tag.endpoint: self.stream_name}))
+        if self.change_detector is not None:
+            finish_change_detection(self.stream_name, self.parent_id, self.change_detector)
+        if self.resume and not self.bookmark_query_field_from and not self.skip:
+            with WRITE_LOCK:
+                update_resume_cursor(
+                    self.state, self.resume_stream, self.parent_id, strftime(self.now_datetime))
+                WRITER.write_state(self.state)
+        return self.endpoint_total
+
+
+# Sync a specific parent or child endpoint.
+def sync_endpoint(
+        client,
+        config,
+        catalog,
+        state,
+        stream_name,
+        endpoint_config,
+        sync_streams,
+        selected_streams,
+        parent_id=None):
+
+    endpoint = EndpointSync(
+        client, config, catalog, state, stream_name, endpoint_config,
+        sync_streams, selected_streams, parent_id)
+
+    # Fetch the API data of a date window
+    def fetch_window(window):
+        url, cache_ttl = endpoint.window_request(window)
 
         # API request data
-        data = {}
+        response_info = {}
         try:
-            data = client.get(
-                url=url,
-                endpoint=stream_name)
+            if endpoint.stream_json:
+                window_data = client.get_records(
+                    url=url,
+                    endpoint=stream_name,
+                    cache_ttl=cache_ttl,
+                    response_info=response_info)
+            else:
+                window_data = client.get(
+                    url=url,
+                    endpoint=stream_name,
+                    cache_ttl=cache_ttl,
+                    response_info=response_info)
+        except CircuitOpenError:
+            # Failed fast, the parent id may be deferred (sync_child_endpoints)
+            raise
         except Exception as err:
             LOGGER.error('{}'.format(err))
             LOGGER.error('URL for Stream {}: {}'.format(stream_name, url))
             raise Exception(err)
 
         # time_extracted: datetime when the data was extracted from the API
-        time_extracted = utils.now()
-        if not data or data is None or data == {}:
-            LOGGER.info('No data results returned')
-        else:
-            # Transform data with transform_json from transform.py
-            # The data_key_array identifies the array/list of records below the <root> element
-            # LOGGER.info('data = {}'.format(data)) # TESTING, comment out
-            transformed_data = [] # initialize the record list
+        return window_data, utils.now(), response_info.get('server_seconds', 0.0)
 
-            if data_key_array:
-                data_records = data.get(data_key_array, [])
-            else:
-                data_records = data
-
-            for record in data_records:
-                # Add parent id field/value
-                if parent and parent_id and parent not in record:
-                    record[parent] = parent_id
-
-                # transform record (remove inconsistent use of CamelCase)
-                try:
-                    transformed_record = humps.decamelize(record)
-                except Exception as err:
-                    LOGGER.error('{}'.format(err))
-                    LOGGER.error('error record: {}'.format(record))
-                    raise Exception(err)
-
-                transformed_data.append(transformed_record)
-                # End for record in array
-            # End non-stats stream
-
-            # LOGGER.info('transformed_data = {}'.format(transformed_data)) # COMMENT OUT
-            if not transformed_data or transformed_data is None:
-                LOGGER.info('No transformed data for data = {}'.format(data))
-            else:
+    # The next windows are fetched (prefetch_windows, window_workers) while the current
+    # window is processed; closed to stop the fetches when the processing fails
+    with contextlib.closing(prefetch(
+            fetch_in_order(fetch_window, endpoint.windows(), endpoint.window_workers),
+            endpoint.prefetch_windows,
+            stream_name)) as fetched_windows:
+        for window, (data, time_extracted, server_seconds) in fetched_windows:
+            records = endpoint.process_data(data, time_extracted, window)
 
-                # Process records and get the max_bookmark_value and record_count
-                if stream_name in sync_streams:
-                    max_bookmark_value, record_count = process_records(
+            # Loop thru parent batch records for each children objects (if should stream)
+            if records is not None:
+                for child_stream_name, child_endpoint_config in endpoint.child_streams():
+                    LOGGER.info('START Syncing: {}'.format(child_stream_name))
+                    write_schema(catalog, child_stream_name)
+                    sync_child_endpoints(
+                        client=client,
+                        config=config,
                         catalog=catalog,
-                        stream_name=stream_name,
-                        records=transformed_data,
-                        time_extracted=time_extracted,
-                        bookmark_field=bookmark_field,
-                        max_bookmark_value=max_bookmark_value,
-                        last_datetime=last_datetime)
-                    LOGGER.info('Stream {}, batch processed {} records'.format(
-                        stream_name, record_count))
-
-                # Loop thru parent batch records for each children objects (if should stream)
-                children = endpoint_config.get('children')
-                if children:
-                    for child_stream_name, child_endpoint_config in children.items():
-                        if child_stream_name in sync_streams:
-                            LOGGER.info('START Syncing: {}'.format(child_stream_name))
-                            write_schema(catalog, child_stream_name)
-                            # For each parent record
-                            for record in transformed_data:
-                                i = 0
-                                # Set parent_id
-                                for id_field in id_fields:
-                                    if i == 0:
-                                        parent_id_field = id_field
-                                    if id_field == 'id':
-                                        parent_id_field = id_field
-                                    i = i + 1
-                                parent_id = record.get(parent_id_field)
-
-                                # sync_endpoint for child
-                                LOGGER.info(
-                                    'START Sync for Stream: {}, parent_stream: {}, parent_id: {}'\
-                                        .format(child_stream_name, stream_name, parent_id))
-
-                                child_total_records = sync_endpoint(
-                                    client=client,
-                                    config=config,
-                                    catalog=catalog,
-                                    state=state,
-                                    stream_name=child_stream_name,
-                                    endpoint_config=child_endpoint_config,
-                                    sync_streams=sync_streams,
-                                    selected_streams=selected_streams,
-                                    parent_id=parent_id)
-
-                                LOGGER.info(
-                                    'FINISHED Sync for Stream: {}, parent_id: {}, total_records: {}'\
-                                        .format(child_stream_name, parent_id, child_total_records))
-                                # End transformed data record loop
-                            # End if child in sync_streams
-                        # End child streams for parent
-                    # End if children
-
-                # Parent record batch
-                total_records = total_records + record_count
-                endpoint_total = endpoint_total + record_count
-
-                LOGGER.info('Synced Stream: {}, records: {}'.format(
-                    stream_name,
-                    total_records))
+                        state=state,
+                        stream_name=child_stream_name,
+                        endpoint_config=child_endpoint_config,
+                        sync_streams=sync_streams,
+                        selected_streams=selected_streams,
+                        parent_stream_name=stream_name,
+                        parent_ids=endpoint.parent_ids(records))
 
-                # Update the state with the max_bookmark_value for the stream date window
-                # Snapchat Ads API does not allow page/batch sorting; bookmark written for date window
-                if bookmark_field and stream_name in selected_streams:
-                    write_bookmark(state, stream_name, max_bookmark_value, bookmark_field, parent, parent_id)
+            endpoint.finish_window(window, records, server_seconds)
+            # End date window
 
-        # Increment date window and sum endpoint_total
-        start_window = end_window + timedelta(days=1)
-        next_end_window = end_window + timedelta(days=date_window_size)
-        if next_end_window > now_datetime:
-            end_window = now_datetime
-        else:
-            end_window = next_end_window
-        # End date window
+    total_records = endpoint.finish()
+
+    validation_config = get_validation_pass(config, endpoint_config)
+    if validation_config and stream_name in sync_streams:
+        total_records = total_records + sync_endpoint(
+            client=client,
+            config=config,
+            catalog=catalog,
+            state=state,
+            stream_name=stream_name,
+            endpoint_config=validation_config,
+            sync_streams=sync_streams,
+            selected_streams=selected_streams,
+            parent_id=parent_id)
 
     # Return total_records (for date windows)
-    return endpoint_total
+    return total_records
+
+
+# config validation_delta: sync the transactions from the bookmark by transaction date
+#   (without the attribution window) and, in a second pass, the transactions validated
+#   since the last sync, with a bookmark of their own
+# Returns the endpoint_config of the second pass, or None
+def get_validation_pass(config, endpoint_config):
+    validation_pass = endpoint_config.get('validation_pass')
+    if not validation_pass or not config.get('validation_delta', False):
+        return None
+    pass_config = dict(endpoint_config, pass_name='validation', **validation_pass)
+    del pass_config['validation_pass']
+    return pass_config
+
+
+def get_parent_id(record, id_fields):
+    # The first key property is the parent id, unless there is an 'id' key property
+    i = 0
+    for id_field in id_fields:
+        if i == 0:
+            parent_id_field = id_field
+        if id_field == 'id':
+            parent_id_field = id_field
+        i = i + 1
+    return record.get(parent_id_field)
+
+
+# Sync a child endpoint for each of the parent ids.
+# config max_workers: number of parent ids synced concurrently; default = 1 (serial)
+# The syncs of parent ids that fail fast on an open circuit breaker (retry.py) are deferred:
+# they are synced again after the other parent ids, when the circuit lets a request
+# through. A deferred sync that fails again fails the sync.
+def sync_child_endpoints(
+        client,
+        config,
+        catalog,
+        state,
+        stream_name,
+        endpoint_config,
+        sync_streams,
+        selected_streams,
+        parent_stream_name,
+        parent_ids):
+
+    def sync_parent_id(parent_id):
+        LOGGER.info('START Sync for Stream: {}, parent_stream: {}, parent_id: {}'.format(
+            stream_name, parent_stream_name, parent_id))
+
+        child_total_records = sync_endpoint(
+            client=client,
+            config=config,
+            catalog=catalog,
+            state=state,
+            stream_name=stream_name,
+            endpoint_config=endpoint_config,
+            sync_streams=sync_streams,
+            selected_streams=selected_streams,
+            parent_id=parent_id)
+
+        LOGGER.info('FINISHED Sync for Stream: {}, parent_id: {}, total_records: {}'.format(
+            stream_name, parent_id, child_total_records))
+        return child_total_records
+
+    # (parent_id, endpoint of the open circuit)
+    deferred = []
+
+    def sync_or_defer(parent_id):
+        try:
+            return sync_parent_id(parent_id)
+        except CircuitOpenError as err:
+            LOGGER.warning('Stream: {}, parent_id: {}, deferred: {}'.format(
+                stream_name, parent_id, err))
+            deferred.append((parent_id, err.endpoint))
+            return 0
+
+    max_workers = int(config.get('max_workers', 1))
+    if max_workers <= 1:
+        total_records = sum(sync_or_defer(parent_id) for parent_id in parent_ids)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers,
+                                thread_name_prefix=stream_name) as executor:
+            futures = [executor.submit(sync_or_defer, parent_id) for parent_id in parent_ids]
+            try:
+                total_records = sum(future.result() for future in futures)
+            except Exception:
+                # Do not start syncs for the remaining parent ids after an error
+                for future in futures:
+                    future.cancel()
+                raise
+
+    for parent_id, endpoint in deferred:
+        for tries in range(1, DEFERRED_TRIES + 1):
+            wait = client.retry_policy.open_seconds(endpoint)
+            if wait > 0:
+                LOGGER.info('Waiting {:.0f}s for the circuit breaker of endpoint {}'.format(
+                    wait, endpoint))
+                time.sleep(wait)
+            try:
+                total_records = total_records + sync_parent_id(parent_id)
+                break
+            except CircuitOpenError as err:
+                endpoint = err.endpoint
+                if tries == DEFERRED_TRIES:
+                    LOGGER.warning('Stream: {}, parent_id: {}, skipped: {}'.format(
+                        stream_name, parent_id, err))
+    return total_records
 
 
 # Currently syncing sets the stream currently being delivered in the state.
@@ -334,14 +893,52 @@ def sync_endpoint(
 #  the starting point to continue from.
 # Reference: https://github.com/singer-io/singer-python/blob/master/singer/bookmarks.py#L41-L46
 def update_currently_syncing(state, stream_name):
-    if (stream_name is None) and ('currently_syncing' in state):
-        del state['currently_syncing']
-    else:
-        singer.set_currently_syncing(state, stream_name)
-    singer.write_state(state)
+    with WRITE_LOCK:
+        if (stream_name is None) and ('currently_syncing' in state):
+            del state['currently_syncing']
+        else:
+            singer.set_currently_syncing(state, stream_name)
+        WRITER.write_state(state, force=True)
 
 
-def sync(client, config, catalog, state):
+# Resume cursor: state['resume'] records the units finished by the current sync, so that
+# a restart after an interruption skips them. It is removed when the sync finishes.
+#   {'started': <start of the sync>,
+#    'streams': {<stream>: {<parent_id>: <end of the last finished date window, or of the
+#                                         sync of an endpoint without date windows>}}}
+# Only endpoints without child streams are skipped, parents are always fetched.
+def get_resume_cursor(state, stream, parent_id):
+    return state.get('resume', {}).get('streams', {}).get(stream, {}).get(str(parent_id))
+
+# Set the resume cursor of a unit, without writing the state
+def update_resume_cursor(state, stream, parent_id, value):
+    with WRITE_LOCK:
+        state['resume'].setdefault('streams', {}).setdefault(stream, {})[str(parent_id)] = value
+
+# config resume: record and skip finished units (see get_resume_cursor); default = false
+# config resume_max_age_hours: ignore the cursor of a sync interrupted longer ago; default = 24
+def prepare_resume(config, state):
+    resume = state.get('resume')
+    if not config.get('resume', False):
+        state.pop('resume', None)
+        return
+
+    if resume:
+        max_age = config.get('resume_max_age_hours', DEFAULT_RESUME_MAX_AGE_HOURS)
+        started = strptime_to_utc(resume['started'])
+        if max_age and started < utils.now() - timedelta(hours=max_age):
+            LOGGER.info('Ignoring the resume cursor of the sync started at {}'.format(
+                resume['started']))
+            resume = None
+        else:
+            LOGGER.info('Resuming the interrupted sync started at {}'.format(resume['started']))
+    if not resume:
+        state['resume'] = {'started': strftime(utils.now())}
+
+
+# Configure the sync and return the streams to sync and the selected streams
+# (None, None if no stream is selected)
+def prepare_sync(config, catalog, state):
     # Get selected_streams from catalog, based on state last_stream
     #   last_stream = Previous currently synced stream, if the load was interrupted
     last_stream = singer.get_currently_syncing(state)
@@ -351,7 +948,12 @@ def sync(client, config, catalog, state):
         selected_streams.append(stream.stream)
     LOGGER.info('selected_streams: {}'.format(selected_streams))
     if not selected_streams or selected_streams == []:
-        return
+        return None, None
+
+    # config shard_index, shard_count: sync only the accounts of this shard
+    validate_shard_config(int(config.get('shard_index', 0)), int(config.get('shard_count', 1)))
+    if int(config.get('shard_count', 1)) > 1:
+        LOGGER.info('Shard {} of {}'.format(config.get('shard_index', 0), config['shard_count']))
 
     # Get the streams to sync (based on dependencies)
     sync_streams = []
@@ -370,25 +972,123 @@ def sync(client, config, catalog, state):
                 sync_streams.append(parent_stream)
     LOGGER.info('Sync Streams: {}'.format(sync_streams))
 
-    # Loop through selected_streams
-    # Loop through endpoints in selected_streams
-    for stream_name, endpoint_config in STREAMS.items():
-        if stream_name in sync_streams:
-            LOGGER.info('START Syncing: {}'.format(stream_name))
-            write_schema(catalog, stream_name)
-            update_currently_syncing(state, stream_name)
-
-            total_records = sync_endpoint(
-                client=client,
-                config=config,
-                catalog=catalog,
-                state=state,
-                stream_name=stream_name,
-                endpoint_config=endpoint_config,
-                sync_streams=sync_streams,
-                selected_streams=selected_streams)
-
-            update_currently_syncing(state, None)
-            LOGGER.info('FINISHED Syncing: {}, total_records: {}'.format(
-                stream_name,
-                total_records))
+    # config output_batch_size: number of records written to stdout at once
+    # config fast_json: encode records with orjson (if installed)
+    # config state_checkpoint_records, state_checkpoint_seconds: write bookmark STATE messages
+    #   only after this many records or seconds; the state is always written at stream end
+    # config output_format: singer (records on stdout), parquet or arrow (record files in
+    #   output_dir, see columnar.ColumnarWriter); SCHEMA and STATE messages are always on stdout
+    # config output_compression, output_file_records: compression and maximum number of
+    #   records buffered per stream of the files
+    record_sink = False
+    state_checkpoint_records = config.get('state_checkpoint_records', 0)
+    state_checkpoint_seconds = config.get('state_checkpoint_seconds', 0)
+    output_format = config.get('output_format', 'singer')
+    if output_format != 'singer':
+        # pyarrow is only imported for the columnar output
+        from tap_awin_advertiser.columnar import (
+            ColumnarWriter, DEFAULT_COMPRESSION, DEFAULT_FILE_RECORDS,
+            DEFAULT_STATE_CHECKPOINT_SECONDS)
+        record_sink = ColumnarWriter(
+            output_dir=config.get('output_dir'),
+            file_format=output_format,
+            compression=config.get('output_compression', DEFAULT_COMPRESSION),
+            file_records=config.get('output_file_records', DEFAULT_FILE_RECORDS),
+            date_fields={
+                stream_name: next(iter(stream_metadata.get('replication_keys', [])), None)
+                for stream_name, stream_metadata in flat_streams.items()})
+        # The records are written to files before each STATE message, a state per date
+        # window would write a file per window and partition
+        state_checkpoint_records = config.get(
+            'state_checkpoint_records', record_sink.file_records)
+        state_checkpoint_seconds = config.get(
+            'state_checkpoint_seconds', DEFAULT_STATE_CHECKPOINT_SECONDS)
+        if not state_checkpoint_records and not state_checkpoint_seconds:
+            LOGGER.warning('Output format {} without state checkpoints: the records are ' \
+                'written to files for every bookmark'.format(output_format))
+
+    WRITER.configure(
+        batch_size=config.get('output_batch_size', DEFAULT_BATCH_SIZE),
+        fast_json=config.get('fast_json', True),
+        state_checkpoint_records=state_checkpoint_records,
+        state_checkpoint_seconds=state_checkpoint_seconds,
+        record_sink=record_sink)
+
+    # config change_detection: streams (FULL_TABLE) of which only new and changed records are written
+    # config change_detection_tombstones: write records with _sdc_deleted_at for deleted records
+    # config fingerprint_file: keep the fingerprints in this file instead of the state
+    FINGERPRINTS.configure(
+        state,
+        streams=config.get('change_detection', []),
+        tombstones=config.get('change_detection_tombstones', False),
+        path=config.get('fingerprint_file'))
+
+    # config deduplicate: streams (with an id key property) of which records already written
+    #   by this run are skipped, per parent id
+    DEDUPLICATOR.configure(streams=config.get('deduplicate', []))
+
+    prepare_resume(config, state)
+
+    return sync_streams, selected_streams
+
+
+# Write the buffered output and the latest state
+def flush_output():
+    with WRITE_LOCK:
+        WRITER.flush_state()
+        WRITER.flush_records()
+        WRITER.flush()
+
+
+# Write the buffered output and the latest state with the fingerprints (of the parents
+# that were synced), also if the sync failed
+def finish_output(state):
+    with WRITE_LOCK:
+        if FINGERPRINTS.save(state):
+            WRITER.write_state(state)
+    flush_output()
+
+
+# Called after all streams were synced successfully
+def finish_sync(state):
+    flush_output()
+    # The next sync starts from the bookmarks again
+    with WRITE_LOCK:
+        if state.pop('resume', None) is not None:
+            WRITER.write_state(state, force=True)
+
+
+def sync(client, config, catalog, state):
+    sync_streams, selected_streams = prepare_sync(config, catalog, state)
+    if not sync_streams:
+        return
+
+    try:
+        # Loop through selected_streams
+        # Loop through endpoints in selected_streams
+        for stream_name, endpoint_config in STREAMS.items():
+            if stream_name in sync_streams:
+                LOGGER.info('START Syncing: {}'.format(stream_name))
+                write_schema(catalog, stream_name)
+                update_currently_syncing(state, stream_name)
+
+                total_records = sync_endpoint(
+                    client=client,
+                    config=config,
+                    catalog=catalog,
+                    state=state,
+                    stream_name=stream_name,
+                    endpoint_config=endpoint_config,
+                    sync_streams=sync_streams,
+                    selected_streams=selected_streams)
+
+                update_currently_syncing(state, None)
+                LOGGER.info('FINISHED Syncing: {}, total_records: {}'.format(
+                    stream_name,
+                    total_records))
+
+        finish_sync(state)
+    finally:
+        # Write the latest state also if the sync failed, it only contains
+        # bookmarks of finished date windows
+        finish_output(state)
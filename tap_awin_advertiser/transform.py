@@ -0,0 +1,251 @@
+import datetime
+import functools
+import re
+import humps
+
+from singer import Transformer
+from singer.utils import strptime_to_utc, strftime
+
+# The API uses a small, fixed vocabulary of keys (commissionAmount, clickRefs, ...),
+# so each key is decamelized by humps only once and the translation is reused.
+KEY_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=KEY_CACHE_SIZE)
+def decamelize_key(key):
+    return humps.decamelize(key)
+
+
+# Same result as humps.decamelize for records (dicts and lists of nested dicts):
+#   the keys of all nested dicts are converted, values (including strings in lists) are not
+def decamelize(obj):
+    if isinstance(obj, dict):
+        return {
+            decamelize_key(key): decamelize(value) if isinstance(value, (dict, list)) else value
+            for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [decamelize(value) if isinstance(value, (dict, list)) else value for value in obj]
+    return obj
+
+
+class SchemaMismatchError(Exception):
+    pass
+
+
+# A schema keyword that is not compiled (records are transformed by singer.Transformer)
+class UnsupportedSchemaError(Exception):
+    pass
+
+
+# The date-time format of the API: 2020-01-31T12:30:00
+ISO_DATETIME = re.compile(r'\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d')
+# The date-time format of singer: 2020-01-31T12:30:00.000000Z
+SINGER_DATETIME = re.compile(r'(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{6})Z')
+
+
+# Parse a date-time to an UTC datetime like singer's strptime_to_utc, with a fast path
+# for the date-time formats of the API and of singer (e.g. transformed records and bookmarks).
+# Other formats (e.g. with a UTC offset) are parsed by singer.
+def parse_datetime(value):
+    if isinstance(value, str):
+        try:
+            if ISO_DATETIME.fullmatch(value):
+                return datetime.datetime.fromisoformat(value).replace(
+                    tzinfo=datetime.timezone.utc)
+            match = SINGER_DATETIME.fullmatch(value)
+            if match:
+                return datetime.datetime.fromisoformat(match.group(1)).replace(
+                    tzinfo=datetime.timezone.utc)
+        except ValueError:
+            pass
+    return strptime_to_utc(value)
+
+
+def transform_datetime(value):
+    if value is None or value == '':
+        raise SchemaMismatchError()
+    try:
+        return strftime(parse_datetime(value))
+    except Exception:
+        raise SchemaMismatchError()
+
+
+def transform_string(value):
+    if value.__class__ is str:
+        return value
+    if value is None:
+        raise SchemaMismatchError()
+    try:
+        return str(value)
+    except Exception:
+        raise SchemaMismatchError()
+
+
+def transform_integer(value):
+    if value.__class__ is int:
+        return value
+    if isinstance(value, str):
+        value = value.replace(',', '')
+    try:
+        return int(value)
+    except Exception:
+        raise SchemaMismatchError()
+
+
+def transform_number(value):
+    if value.__class__ is float:
+        return value
+    if isinstance(value, str):
+        value = value.replace(',', '')
+    try:
+        return float(value)
+    except Exception:
+        raise SchemaMismatchError()
+
+
+def transform_boolean(value):
+    if isinstance(value, str) and value.lower() == 'false':
+        return False
+    try:
+        return bool(value)
+    except Exception:
+        raise SchemaMismatchError()
+
+
+def transform_null(value):
+    if value is None or value == '':
+        return None
+    raise SchemaMismatchError()
+
+
+def transform_unchanged(value):
+    return value
+
+
+def compile_type(typ, schema):
+    if typ == 'null':
+        return transform_null
+    if schema.get('format') == 'date-time':
+        return transform_datetime
+    if typ == 'object':
+        return compile_object(schema)
+    if typ == 'array':
+        return compile_array(schema)
+    return {
+        'string': transform_string,
+        'integer': transform_integer,
+        'number': transform_number,
+        'boolean': transform_boolean
+    }.get(typ)
+
+
+def compile_object(schema):
+    if schema.get('patternProperties'):
+        raise UnsupportedSchemaError('patternProperties')
+    properties = {
+        key: compile_schema(sub_schema)
+        for key, sub_schema in schema.get('properties', {}).items()}
+
+    def transform_object(value):
+        if not isinstance(value, dict):
+            raise SchemaMismatchError()
+        # Objects without properties are not touched
+        if not properties:
+            return value
+        # Keys which are not in the schema are removed
+        result = {}
+        for key, sub_value in value.items():
+            transform = properties.get(key)
+            if transform is not None:
+                result[key] = transform(sub_value)
+        return result
+
+    return transform_object
+
+
+def compile_array(schema):
+    transform_item = compile_schema(schema['items'])
+
+    def transform_array(value):
+        if not isinstance(value, list):
+            raise SchemaMismatchError()
+        return [transform_item(item) for item in value]
+
+    return transform_array
+
+
+def compile_schema(schema):
+    if 'anyOf' in schema:
+        raise UnsupportedSchemaError('anyOf')
+    if 'type' not in schema:
+        # No typing information, the value is not transformed
+        return transform_unchanged
+
+    types = schema['type']
+    if not isinstance(types, list):
+        types = [types]
+    # null is always tried last
+    types = [typ for typ in types if typ != 'null'] + [typ for typ in types if typ == 'null']
+    transforms = [compile_type(typ, schema) for typ in types]
+
+    def transform_unknown_type(value):
+        raise SchemaMismatchError()
+
+    transforms = [transform or transform_unknown_type for transform in transforms]
+    if len(transforms) == 1:
+        return transforms[0]
+
+    # None is only accepted by the null type, unless it can be converted to a boolean
+    none_is_null = 'null' in types and 'boolean' not in types
+
+    def transform_types(value):
+        if value is None and none_is_null:
+            return None
+        for transform in transforms:
+            try:
+                return transform(value)
+            except SchemaMismatchError:
+                pass
+        raise SchemaMismatchError()
+
+    return transform_types
+
+
+# Transforms records like singer.Transformer (with the default integer_datetime_fmt),
+# but the schema and metadata are compiled into nested transform functions once, instead of
+# being interpreted for every record. Records that do not match the schema are transformed
+# again by singer.Transformer, which raises the SchemaMismatch with the error details.
+class RecordTransformer:
+    def __init__(self, schema, mdata=None):
+        self.schema = schema
+        self.mdata = mdata or {}
+        try:
+            self.__transform = compile_schema(schema)
+        except UnsupportedSchemaError:
+            self.__transform = None
+
+        # Top level fields removed by singer's filter_data_by_metadata
+        self.__filtered_fields = set()
+        for breadcrumb, field_metadata in self.mdata.items():
+            if len(breadcrumb) != 2 or breadcrumb[0] != 'properties':
+                continue
+            if field_metadata.get('inclusion') == 'automatic':
+                continue
+            if field_metadata.get('selected') is False or \
+                    field_metadata.get('inclusion') == 'unsupported':
+                self.__filtered_fields.add(breadcrumb[1])
+
+    def transform(self, record):
+        if self.__transform is None:
+            return self.__singer_transform(record)
+
+        for field_name in self.__filtered_fields:
+            record.pop(field_name, None)
+        try:
+            return self.__transform(record)
+        except SchemaMismatchError:
+            return self.__singer_transform(record)
+
+    def __singer_transform(self, record):
+        with Transformer() as transformer:
+            return transformer.transform(record, self.schema, self.mdata)
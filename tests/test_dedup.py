@@ -0,0 +1,94 @@
+# Ids of the records written by the run (tap_awin_advertiser.dedup.IdSet): the sorted
+# array of 64 bit keys and the set of the ids added since the last merge.
+#
+# Usage: python -m pytest tests
+import random
+
+import pytest
+
+from tap_awin_advertiser import dedup
+from tap_awin_advertiser.dedup import IdSet, Deduplicator, id_key
+
+
+@pytest.fixture(autouse=True)
+def small_merges(monkeypatch):
+    monkeypatch.setattr(dedup, 'MIN_PENDING', 8)
+
+
+def test_duplicates_before_and_after_merge():
+    ids = IdSet()
+    assert ids.add(5)
+    assert not ids.add(5)
+    ids.merge()
+    assert not ids.pending
+    assert list(ids.ids) == [5]
+    assert not ids.add(5)
+    assert ids.add(6)
+    assert ids.duplicates == 2
+    assert len(ids) == 2
+
+
+def test_merge_threshold():
+    ids = IdSet()
+    for record_id in range(7):
+        ids.add(record_id)
+    assert len(ids.pending) == 7 and not ids.ids
+    # The 8th id (MIN_PENDING) merges the pending ids into the sorted array
+    ids.add(7)
+    assert not ids.pending
+    assert list(ids.ids) == list(range(8))
+    assert all(not ids.add(record_id) for record_id in range(8))
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_like_a_set(ordered):
+    rand = random.Random(0)
+    record_ids = list(range(0, 3000, 3))
+    if not ordered:
+        rand.shuffle(record_ids)
+    # Duplicates of recent and of older ids, across several merges
+    record_ids = [
+        record_ids[max(0, index - rand.randrange(1, 500))] if rand.random() < 0.2 else record_id
+        for index, record_id in enumerate(record_ids)]
+    ids = IdSet()
+    seen = set()
+    for record_id in record_ids:
+        assert ids.add(record_id) == (record_id not in seen)
+        seen.add(record_id)
+    ids.merge()
+    assert list(ids.ids) == sorted(seen)
+    assert ids.duplicates == len(record_ids) - len(seen)
+
+
+def test_ids_below_and_between_sorted_ids():
+    ids = IdSet()
+    for record_id in range(100, 200, 10):
+        ids.add(record_id)
+    ids.merge()
+    for record_id in (-5, 105, 100, 250, 195):
+        ids.add(record_id)
+    ids.merge()
+    assert list(ids.ids) == sorted(set(range(100, 200, 10)) | {-5, 105, 250, 195})
+    assert ids.duplicates == 1
+
+
+def test_other_ids():
+    ids = IdSet()
+    assert ids.add('abc')
+    assert ids.add(2 ** 70)
+    assert ids.add(None)
+    assert ids.add(None)
+    ids.merge()
+    assert not ids.add('abc')
+    assert not ids.add(2 ** 70)
+    assert id_key(7) == 7
+    assert id_key('7') != 7
+
+
+def test_deduplicator():
+    deduplicator = Deduplicator()
+    deduplicator.configure(streams=['transactions'])
+    assert deduplicator.enabled('transactions')
+    assert not deduplicator.enabled('publishers')
+    assert deduplicator.get('transactions', 1) is deduplicator.get('transactions', 1)
+    assert deduplicator.get('transactions', 1) is not deduplicator.get('transactions', 2)
@@ -0,0 +1,92 @@
+# Incremental decoding of JSON arrays (tap_awin_advertiser.json_stream.iter_json_array):
+# the elements must equal json.loads of the whole body for any split of the body into chunks.
+#
+# Usage: python -m pytest tests
+import json
+import random
+
+import pytest
+
+from tap_awin_advertiser import json_stream
+from tap_awin_advertiser.json_stream import iter_json_array
+
+RECORDS = [
+    {'id': 1, 'commissionAmount': {'amount': 1.5e3, 'currency': 'EUR'}},
+    {'id': 2, 'url': 'https://example.com/?a=[1]&b={2}', 'clickRefs': None},
+    {'id': 3, 'comment': 'quote " backslash \\ brace } bracket ] comma ,', 'paid': True},
+    {'id': 4, 'siteName': 'Zürich ✓ é', 'values': [1, -2.25, 3e-2, [], {}]},
+    'a string with ", and ]',
+    12345678901234567890,
+    -0.5,
+    None,
+    False,
+    [[1, [2]], {'a': [{'b': '}'}]}],
+]
+
+
+def chunked(body, sizes):
+    data = body.encode('utf-8')
+    chunks = []
+    pos = 0
+    for size in sizes:
+        chunks.append(data[pos:pos + size])
+        pos += size
+    chunks.append(data[pos:])
+    return chunks
+
+
+def split_everywhere(body):
+    data = body.encode('utf-8')
+    for split in range(len(data) + 1):
+        yield [data[:split], data[split:]]
+
+
+@pytest.mark.parametrize('body', [
+    json.dumps(RECORDS),
+    json.dumps(RECORDS, indent=2),
+    json.dumps(RECORDS, ensure_ascii=False),
+    ' \n[ 1 , 2 ,3 ] \n',
+])
+def test_any_split(body):
+    expected = json.loads(body)
+    # Each split position, e.g. inside strings, escapes, numbers and multibyte characters
+    for chunks in split_everywhere(body):
+        assert list(iter_json_array(chunks)) == expected
+    # One byte chunks and random chunk sizes
+    assert list(iter_json_array(chunked(body, [1] * len(body.encode('utf-8'))))) == expected
+    rand = random.Random(0)
+    for _ in range(50):
+        sizes = [rand.randint(0, 20) for _ in range(len(body))]
+        assert list(iter_json_array(chunked(body, sizes))) == expected
+
+
+def test_compacted_buffer(monkeypatch):
+    # The consumed part of the buffer is dropped while decoding
+    monkeypatch.setattr(json_stream, 'COMPACT_SIZE', 16)
+    records = [{'id': index, 'name': 'record {}'.format(index)} for index in range(200)]
+    body = json.dumps(records)
+    assert list(iter_json_array(chunked(body, [7] * len(body)))) == records
+
+
+@pytest.mark.parametrize('body', ['', '  ', '[]', ' [ ] ', '{}', 'null'])
+def test_empty(body):
+    assert list(iter_json_array([body.encode('utf-8')])) == []
+
+
+def test_lazy():
+    # Elements are yielded before the rest of the body is read
+    def chunks():
+        yield b'[{"id": 1}, '
+        raise AssertionError('read too far')
+
+    assert next(iter_json_array(chunks())) == {'id': 1}
+
+
+@pytest.mark.parametrize('body', [
+    '[', '[1', '[1,', '[1, 2', '[{"id": 1', '["abc', '[1,]', '[1 2]', '[1] 2', '{"id": 1}',
+    '"text"',
+])
+def test_invalid(body):
+    for chunks in split_everywhere(body):
+        with pytest.raises(ValueError):
+            list(iter_json_array(chunks))
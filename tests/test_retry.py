@@ -0,0 +1,138 @@
+# Retries, retry budget and circuit breakers (tap_awin_advertiser.retry) and the deferral
+# of the accounts of a child stream whose circuit breaker is open.
+#
+# Usage: python -m pytest tests
+import pytest
+
+from tap_awin_advertiser import sync
+from tap_awin_advertiser.client import AwinClient, Server5xxError
+from tap_awin_advertiser.retry import (
+    CircuitBreaker, CircuitOpenError, RetryPolicy, BREAKER_MIN_REQUESTS)
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda seconds: None)
+
+
+# A client of which each request fails with the next error of errors (None = success)
+def failing_client(retry_policy, errors):
+    client = AwinClient('token', requests_per_minute=0, retry_policy=retry_policy)
+    errors = list(errors)
+    tries = []
+
+    def request(method, url, endpoint, response_info, **kwargs):
+        tries.append(url)
+        error = errors.pop(0) if errors else None
+        if error is not None:
+            raise error
+        return {}
+
+    client._AwinClient__request = request  # pylint: disable=protected-access
+    return client, tries
+
+
+def test_breaker_disabled_by_default():
+    policy = RetryPolicy()
+    for _ in range(2 * BREAKER_MIN_REQUESTS):
+        policy.record('transactions', True)
+    policy.check('transactions')
+    assert policy.open_seconds('transactions') == 0
+
+
+def test_breaker_opens_and_closes():
+    breaker = CircuitBreaker('transactions', threshold=0.5, cooldown=60)
+    for _ in range(BREAKER_MIN_REQUESTS - 1):
+        breaker.record(True, 0)
+    assert breaker.allow(0) == 0
+    breaker.record(True, 0)
+    assert breaker.allow(10) == 50
+    # Half open after the cooldown: one trial request at a time
+    assert breaker.allow(60) == 0
+    assert breaker.allow(61) > 0
+    breaker.record(False, 62)
+    assert breaker.allow(62) == 0
+    assert breaker.opened == 1
+
+
+def test_breaker_failed_trial_opens_again():
+    breaker = CircuitBreaker('transactions', threshold=0.5, cooldown=60)
+    for _ in range(BREAKER_MIN_REQUESTS):
+        breaker.record(True, 0)
+    assert breaker.allow(60) == 0
+    breaker.record(True, 61)
+    assert breaker.allow(100) == 21
+    assert breaker.opened == 2
+
+
+def test_breaker_counts_a_request_once():
+    # A request that succeeds at the last of its tries does not open the circuit
+    policy = RetryPolicy(max_tries=20, breaker_threshold=0.5)
+    client, tries = failing_client(policy, [Server5xxError()] * 19)
+    assert client.request('GET', url='http://api/transactions', endpoint='transactions') == {}
+    assert len(tries) == 20
+    assert policy.open_seconds('transactions') == 0
+
+
+def test_breaker_opens_after_failed_requests():
+    policy = RetryPolicy(max_tries=2, breaker_threshold=0.5)
+    client, tries = failing_client(policy, [Server5xxError()] * 2 * BREAKER_MIN_REQUESTS)
+    for _ in range(BREAKER_MIN_REQUESTS):
+        with pytest.raises(Server5xxError):
+            client.request('GET', url='http://api/transactions', endpoint='transactions')
+    assert len(tries) == 2 * BREAKER_MIN_REQUESTS
+    with pytest.raises(CircuitOpenError):
+        client.request('GET', url='http://api/transactions', endpoint='transactions')
+    assert len(tries) == 2 * BREAKER_MIN_REQUESTS
+
+
+def test_max_tries():
+    client, tries = failing_client(RetryPolicy(max_tries=3), [Server5xxError()] * 5)
+    with pytest.raises(Server5xxError):
+        client.request('GET', url='http://api/transactions', endpoint='transactions')
+    assert len(tries) == 3
+
+
+def test_retry_budget():
+    policy = RetryPolicy(max_tries=10, budget_seconds=5)
+    error = Server5xxError()
+    error.retry_after = 3
+    assert policy.retry_delay('transactions', 1, error) == 3
+    # 2 seconds of the budget are left
+    assert policy.retry_delay('transactions', 2, error) is None
+
+
+class Client:
+    def __init__(self, retry_policy):
+        self.retry_policy = retry_policy
+
+
+def sync_children(monkeypatch, fail_tries):
+    # The first fail_tries syncs of parent id 2 fail on an open circuit
+    synced = []
+
+    def sync_endpoint(parent_id, **kwargs):
+        if parent_id == 2 and synced.count(2) < fail_tries:
+            synced.append(parent_id)
+            raise CircuitOpenError('transactions', 60)
+        synced.append(parent_id)
+        return 10
+
+    monkeypatch.setattr(sync, 'sync_endpoint', sync_endpoint)
+    total_records = sync.sync_child_endpoints(
+        client=Client(RetryPolicy(breaker_threshold=0.5)), config={}, catalog=None, state={},
+        stream_name='transactions', endpoint_config={}, sync_streams=[],
+        selected_streams=[], parent_stream_name='accounts', parent_ids=[1, 2, 3])
+    return total_records, synced
+
+
+def test_deferred_parent_synced_again(monkeypatch):
+    total_records, synced = sync_children(monkeypatch, fail_tries=2)
+    assert synced == [1, 2, 3, 2, 2]
+    assert total_records == 30
+
+
+def test_deferred_parent_skipped(monkeypatch):
+    total_records, synced = sync_children(monkeypatch, fail_tries=100)
+    assert synced == [1, 2, 3] + [2] * sync.DEFERRED_TRIES
+    assert total_records == 20
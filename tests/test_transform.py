@@ -0,0 +1,119 @@
+# Differential check of tap_awin_advertiser.transform.RecordTransformer: the output for the
+# records of all streams must equal singer.Transformer's, including records with values that
+# need type conversion and records that do not match the schema.
+#
+# Usage: python -m pytest tests
+import copy
+import logging
+import os
+import random
+import sys
+
+import pytest
+from singer import metadata, Transformer
+from singer.transform import SchemaMismatch
+from singer.utils import strptime_to_utc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'benchmarks'))
+
+# pylint: disable=wrong-import-position
+from fake_data import fake_account, fake_publisher, fake_transaction
+from tap_awin_advertiser.schema import get_schemas
+from tap_awin_advertiser.transform import (
+    decamelize, compile_schema, parse_datetime, RecordTransformer, UnsupportedSchemaError)
+
+# Values replacing a random field of a record
+MUTATIONS = [None, '', '12', '1,234', '1.5', 'abc', 0, 1, 7.5, True, 'false', [], {},
+             [{'amount': '3'}], {'amount': '2', 'currency': 'EUR', 'extra': 1},
+             '2021-03-04T05:06:07', '2021-03-04', '2021-03-04T05:06:07+02:00', 'not a date',
+             '2020-01-31T12:30+01', '2020-01-31T12:30:00.000000+01:00Z',
+             '2020-01-31T12:30:00.000000Z', '2020-01-31 12:30:00']
+
+SAMPLE_RECORDS = 100
+
+FAKE_RECORDS = {
+    'accounts': fake_account,
+    'publishers': fake_publisher,
+    'transactions': lambda index: fake_transaction(1001, index),
+}
+
+
+@pytest.fixture(autouse=True)
+def no_warnings():
+    # singer logs a warning for every invalid date-time
+    logging.disable(logging.WARNING)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+def sample(stream_name):
+    return [decamelize(FAKE_RECORDS[stream_name](index)) for index in range(SAMPLE_RECORDS)]
+
+
+def singer_transform(record, schema, mdata):
+    with Transformer() as transformer:
+        return transformer.transform(record, schema, mdata)
+
+
+def result(func, *args):
+    try:
+        return func(*args)
+    except SchemaMismatch:
+        return SchemaMismatch
+
+
+def check(stream_name, records, schema, mdata, mutations):
+    transformer = RecordTransformer(schema, mdata)
+    rand = random.Random(stream_name)
+    for record in records:
+        candidates = [record]
+        for _ in range(mutations):
+            mutated = copy.deepcopy(record)
+            key = rand.choice(list(mutated))
+            mutated[key] = copy.deepcopy(rand.choice(MUTATIONS))
+            mutated['unknown_field'] = 'removed'
+            candidates.append(mutated)
+        for candidate in candidates:
+            expected = result(singer_transform, copy.deepcopy(candidate), schema, mdata)
+            actual = result(transformer.transform, copy.deepcopy(candidate))
+            assert expected == actual, (stream_name, candidate, expected, actual)
+
+
+@pytest.mark.parametrize('stream_name', sorted(FAKE_RECORDS))
+def test_transform_like_singer(stream_name):
+    schemas, field_metadata = get_schemas()
+    check(stream_name, sample(stream_name), schemas[stream_name],
+          metadata.to_map(field_metadata[stream_name]), mutations=10)
+
+
+def test_transform_removes_deselected_fields():
+    schemas, field_metadata = get_schemas()
+    # Fields that are not selected or unsupported are removed
+    mdata = metadata.to_map(field_metadata['transactions'])
+    mdata = metadata.write(mdata, ('properties', 'url'), 'selected', False)
+    mdata = metadata.write(mdata, ('properties', 'site_name'), 'inclusion', 'unsupported')
+    check('transactions', sample('transactions'), schemas['transactions'], mdata, mutations=5)
+
+
+def test_unsupported_schema():
+    schema = {
+        'type': 'object',
+        'properties': {
+            'id': {'type': 'integer'},
+            'value': {'anyOf': [{'type': 'integer'}, {'type': 'string'}]}
+        }
+    }
+    with pytest.raises(UnsupportedSchemaError):
+        compile_schema(schema)
+    # Transformed by singer.Transformer
+    check('anyOf', [{'id': '1', 'value': '2'}, {'id': 3, 'value': 'abc'}], schema, {},
+          mutations=5)
+
+
+@pytest.mark.parametrize('value', [
+    '2020-01-31T12:30:00', '2020-01-31T12:30:00.000000Z', '2020-01-31T12:30+01',
+    '2020-01-31T12:30:00+01:00', '2020-01-31T12:30:00.123456+01:00', '2020-01-31',
+    '2020-01-31 12:30:00'])
+def test_parse_datetime_like_singer(value):
+    assert parse_datetime(value) == strptime_to_utc(value)